@@ -0,0 +1,197 @@
+"""Pre-aggregated quiz analytics.
+
+Grading increments counters in the ``quiz_stats`` collection, so reading
+them never touches ``quiz_attempts``. Every counter exists once per UTC day
+and once for ``day == 'all'``, under a deterministic ``_id``:
+
+* ``m|<course_id>|<module_id>|<day>``        - attempts, passed, score_sum
+* ``q|<course_id>|<module_id>|<index>|<day>`` - attempts, correct
+
+``python analytics.py`` rebuilds the whole collection from
+``quiz_attempts``. Per-question counters can only be rebuilt for attempts
+that stored ``answers_correct``.
+"""
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+import storage
+
+ALL_TIME = 'all'
+# completed_at is an ISO string, or a BSON date in the compact storage format.
+ATTEMPT_DAY = {'$cond': [
+    {'$eq': [{'$type': '$completed_at'}, 'date']},
+    {'$dateToString': {'format': '%Y-%m-%d', 'date': '$completed_at'}},
+    {'$substrBytes': ['$completed_at', 0, 10]},
+]}
+
+def module_key(course_id: str, module_id: str, day: str) -> str:
+    return f'm|{course_id}|{module_id}|{day}'
+
+def question_key(course_id: str, module_id: str, index: int, day: str) -> str:
+    return f'q|{course_id}|{module_id}|{index}|{day}'
+
+def utc_day(now: Optional[datetime] = None) -> str:
+    return (now or datetime.now(timezone.utc)).strftime('%Y-%m-%d')
+
+def counter_updates(course_id: str, module_id: str, answers_correct: List[bool], score: float,
+                    passed: bool, day: str) -> List[UpdateOne]:
+    ops = []
+    for bucket in (day, ALL_TIME):
+        ops.append(UpdateOne(
+            {'_id': module_key(course_id, module_id, bucket)},
+            {'$inc': {'attempts': 1, 'passed': int(passed), 'score_sum': score},
+             '$setOnInsert': {'kind': 'module', 'course_id': course_id, 'module_id': module_id, 'day': bucket}},
+            upsert=True,
+        ))
+        for index, correct in enumerate(answers_correct):
+            ops.append(UpdateOne(
+                {'_id': question_key(course_id, module_id, index, bucket)},
+                {'$inc': {'attempts': 1, 'correct': int(correct)},
+                 '$setOnInsert': {'kind': 'question', 'course_id': course_id, 'module_id': module_id,
+                                  'index': index, 'day': bucket}},
+                upsert=True,
+            ))
+    return ops
+
+async def record_attempt(db, course_id: str, module_id: str, answers_correct: List[bool], score: float,
+                         passed: bool, now: Optional[datetime] = None):
+    await db.quiz_stats.bulk_write(
+        counter_updates(course_id, module_id, answers_correct, score, passed, utc_day(now)),
+        ordered=False,
+    )
+
+async def record_attempts(db, attempts: List[dict], now: Optional[datetime] = None):
+    """Count several graded ``quiz_attempts`` documents in a single bulk write."""
+    day = utc_day(now)
+    ops = [op for a in attempts
+           for op in counter_updates(a['course_id'], a['module_id'], a['answers_correct'], a['score'], a['passed'], day)]
+    if ops:
+        await db.quiz_stats.bulk_write(ops, ordered=False)
+
+def _rate(part: int, whole: int) -> float:
+    return round(part / whole * 100, 2) if whole else 0.0
+
+async def course_stats(db, course: dict, day: str = ALL_TIME) -> dict:
+    """Read the counters for every module and question of ``course`` by key."""
+    keys = []
+    for module in course['modules']:
+        keys.append(module_key(course['id'], module['id'], day))
+        keys.extend(question_key(course['id'], module['id'], i, day) for i in range(len(module['questions'])))
+    counters = {doc['_id']: doc async for doc in db.quiz_stats.find({'_id': {'$in': keys}})}
+
+    modules = []
+    for module in course['modules']:
+        m = counters.get(module_key(course['id'], module['id'], day), {})
+        attempts = m.get('attempts', 0)
+        questions = []
+        for i, question in enumerate(module['questions']):
+            q = counters.get(question_key(course['id'], module['id'], i, day), {})
+            questions.append({
+                'index': i,
+                'question': question.get('question'),
+                'attempts': q.get('attempts', 0),
+                'correct': q.get('correct', 0),
+                'correct_rate': _rate(q.get('correct', 0), q.get('attempts', 0)),
+            })
+        modules.append({
+            'module_id': module['id'],
+            'title': module['title'],
+            'attempts': attempts,
+            'passed': m.get('passed', 0),
+            'pass_rate': _rate(m.get('passed', 0), attempts),
+            'average_score': round(m.get('score_sum', 0) / attempts, 2) if attempts else 0.0,
+            'questions': questions,
+        })
+    return {'course_id': course['id'], 'day': day, 'modules': modules}
+
+def _group_id(row: dict) -> dict:
+    g = storage.decode(row.pop('_id'))
+    # Anything else would produce counter keys that never match the ones grading writes.
+    if not all(isinstance(g[k], str) for k in ('course_id', 'module_id', 'day')):
+        raise TypeError(f'Cannot build a quiz_stats key from {g!r}; is the database wrapped by storage.wrap_database?')
+    return g
+
+async def backfill(db, batch_size: int = 1000) -> int:
+    """Rebuild ``quiz_stats`` from ``quiz_attempts`` and swap it in atomically.
+
+    Counter increments made while the rebuild runs are lost with the old
+    collection, so run it when traffic is low. ``db`` must come from
+    ``storage.wrap_database`` so ids read back as strings in every storage
+    format.
+    """
+    day = ATTEMPT_DAY
+    totals: Dict[str, dict] = {}
+    target = db.quiz_stats_rebuild
+    await target.drop()
+    ops: List[UpdateOne] = []
+    written = 0
+
+    async def add(key: str, doc: dict, counts: dict):
+        nonlocal written
+        # $inc, since in dual mode the same ids group once per encoding.
+        ops.append(UpdateOne({'_id': key}, {'$inc': counts, '$setOnInsert': doc}, upsert=True))
+        if len(ops) >= batch_size:
+            await target.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops.clear()
+
+    def add_to_total(key: str, doc: dict, counts: dict):
+        total = totals.setdefault(key.rsplit('|', 1)[0], {'doc': {**doc, 'day': ALL_TIME}, 'counts': {}})
+        for name, value in counts.items():
+            total['counts'][name] = total['counts'].get(name, 0) + value
+
+    module_rows = db.quiz_attempts.aggregate([
+        {'$group': {
+            '_id': {'course_id': '$course_id', 'module_id': '$module_id', 'day': day},
+            'attempts': {'$sum': 1},
+            'passed': {'$sum': {'$cond': ['$passed', 1, 0]}},
+            'score_sum': {'$sum': '$score'},
+        }},
+    ], allowDiskUse=True)
+    async for row in module_rows:
+        g = _group_id(row)
+        key = module_key(g['course_id'], g['module_id'], g['day'])
+        await add(key, {'kind': 'module', **g}, row)
+        add_to_total(key, {'kind': 'module', **g}, row)
+
+    question_rows = db.quiz_attempts.aggregate([
+        {'$match': {'answers_correct': {'$exists': True}}},
+        {'$unwind': {'path': '$answers_correct', 'includeArrayIndex': 'index'}},
+        {'$group': {
+            '_id': {'course_id': '$course_id', 'module_id': '$module_id', 'index': '$index', 'day': day},
+            'attempts': {'$sum': 1},
+            'correct': {'$sum': {'$cond': ['$answers_correct', 1, 0]}},
+        }},
+    ], allowDiskUse=True)
+    async for row in question_rows:
+        g = _group_id(row)
+        key = question_key(g['course_id'], g['module_id'], g['index'], g['day'])
+        await add(key, {'kind': 'question', **g}, row)
+        add_to_total(key, {'kind': 'question', **g}, row)
+
+    for prefix, total in totals.items():
+        await add(f'{prefix}|{ALL_TIME}', total['doc'], total['counts'])
+    if ops:
+        await target.bulk_write(ops, ordered=False)
+        written += len(ops)
+    if written:
+        await target.rename('quiz_stats', dropTarget=True)
+    return written
+
+async def main():
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], uuidRepresentation='standard', tz_aware=True)
+    db = storage.wrap_database(client[os.environ['DB_NAME']], os.environ.get('STORAGE_FORMAT', storage.STRING))
+    written = await backfill(db)
+    client.close()
+    print(f'Rebuilt {written} quiz_stats counters')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Compare per-request insert_one with the write-behind buffer for quiz_attempts.
+
+    python bench_quiz_writes.py --attempts 50000 --concurrency 64
+
+Writes into a scratch ``bench_quiz_attempts`` collection of DB_NAME and
+drops it afterwards.
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from write_behind import WriteBehindBuffer
+
+def attempt() -> dict:
+    return {
+        'id': str(uuid.uuid4()),
+        'user_id': str(uuid.uuid4()),
+        'module_id': str(uuid.uuid4()),
+        'course_id': str(uuid.uuid4()),
+        'score': 100.0,
+        'passed': True,
+        'completed_at': datetime.now(timezone.utc).isoformat(),
+    }
+
+async def run_requests(n: int, concurrency: int, write):
+    latencies = []
+
+    async def worker(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            await write(attempt())
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker(n // concurrency) for _ in range(concurrency)))
+    latencies.sort()
+    return latencies
+
+def report(name: str, n: int, elapsed: float, latencies):
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f'{name:<14} {n / elapsed:>10,.0f} inserts/s   request p50 {p50:.3f}ms  p99 {p99:.3f}ms')
+
+async def main(args):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    collection = client[os.environ['DB_NAME']].bench_quiz_attempts
+    n = args.attempts - args.attempts % args.concurrency
+
+    await collection.drop()
+    started = time.perf_counter()
+    latencies = await run_requests(n, args.concurrency, collection.insert_one)
+    report('insert_one', n, time.perf_counter() - started, latencies)
+
+    await collection.drop()
+    buffer = WriteBehindBuffer(collection, max_batch=args.batch, spill_dir=args.spill_dir)
+    await buffer.start()
+    started = time.perf_counter()
+    latencies = await run_requests(n, args.concurrency, buffer.put)
+    await buffer.close(timeout=600)
+    report('write-behind', n, time.perf_counter() - started, latencies)
+
+    await collection.drop()
+    client.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--attempts', type=int, default=50_000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--spill-dir', type=Path)
+    asyncio.run(main(parser.parse_args()))
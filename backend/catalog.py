@@ -0,0 +1,79 @@
+"""Per-worker copy of the course and reward catalogs.
+
+Both collections are read on nearly every request but change rarely, so
+they are held in memory, together with the course search index, and
+reloaded after ``ttl`` seconds or on ``invalidate()``.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import search
+
+class CatalogCache:
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        # Set by the server's lifespan handler once the client is open.
+        self.db = None
+        self.courses: Dict[str, dict] = {}
+        self.rewards: Dict[str, dict] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self.search_index = search.SearchIndex()
+
+    async def refresh(self):
+        courses = await self.db.courses.find({}, {'_id': 0}).to_list(None)
+        rewards = await self.db.rewards.find({}, {'_id': 0}).to_list(None)
+        self.courses = {c['id']: c for c in courses}
+        self.rewards = {r['id']: r for r in rewards}
+        # Only courses whose indexed text changed are re-indexed.
+        self.search_index.sync(self.courses)
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    async def _ensure_fresh(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        async with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+                await self.refresh()
+
+    async def list_courses(self, limit: int = 100) -> List[dict]:
+        await self._ensure_fresh()
+        return list(self.courses.values())[:limit]
+
+    async def get_course(self, course_id: str) -> Optional[dict]:
+        await self._ensure_fresh()
+        course = self.courses.get(course_id)
+        if course is None:
+            # May have been created by another worker since the last refresh.
+            course = await self.db.courses.find_one({'id': course_id}, {'_id': 0})
+            if course:
+                self.courses[course_id] = course
+                self.search_index.upsert(course)
+        return course
+
+    async def search_courses(self, query: str, limit: int = 20) -> List[dict]:
+        await self._ensure_fresh()
+        results = []
+        for course_id, score in self.search_index.search(query, limit):
+            course = self.courses.get(course_id)
+            if course is not None:
+                results.append({**course, 'modules': [{'id': m['id'], 'title': m['title']} for m in course['modules']],
+                                'score': round(score, 4)})
+        return results
+
+    async def list_rewards(self, limit: int = 100) -> List[dict]:
+        await self._ensure_fresh()
+        return list(self.rewards.values())[:limit]
+
+    async def get_reward(self, reward_id: str) -> Optional[dict]:
+        await self._ensure_fresh()
+        reward = self.rewards.get(reward_id)
+        if reward is None:
+            reward = await self.db.rewards.find_one({'id': reward_id}, {'_id': 0})
+            if reward:
+                self.rewards[reward_id] = reward
+        return reward
@@ -0,0 +1,194 @@
+"""Bulk course import from NDJSON.
+
+Each line is one JSON object:
+
+* a course (validated as ``Course``), upserted by ``id``. Fields the line
+  leaves out keep their stored values; a new course gets the model
+  defaults, and ``created_at`` is the import time. ``modules`` replace the
+  stored ones; leave the key out to keep them.
+* a module with a ``course_id`` (validated as ``Module``), replacing the
+  module with the same ``id`` in that course or appended to it. Module
+  lines may follow their course line in the same file.
+
+Input is read line by line and written in ordered ``bulk_write`` batches,
+so memory use depends on ``batch_size``, not on the file size. Invalid
+lines are reported and skipped; the rest of the file is still imported.
+
+    python course_import.py courses.ndjson [--batch-size 500]
+
+The CLI writes to MongoDB directly, so running servers pick the changes
+up after ``CATALOG_CACHE_TTL``. ``POST /api/admin/courses/import`` takes
+the same format and refreshes the serving worker's catalog immediately.
+"""
+import argparse
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Tuple
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import storage
+
+MAX_LINE_BYTES = 4 * 1024 * 1024
+MAX_REPORTED_ERRORS = 100
+
+class ImportReport:
+    def __init__(self):
+        self.lines = 0
+        self.courses = 0
+        self.modules = 0
+        self.created = 0
+        self.unmatched_modules = 0
+        self.error_count = 0
+        self.errors: List[dict] = []
+
+    def error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self) -> dict:
+        return {
+            'lines': self.lines,
+            'courses': self.courses,
+            'modules': self.modules,
+            'created': self.created,
+            'unmatched_modules': self.unmatched_modules,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines without holding more than one line."""
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line
+        if len(buffer) > MAX_LINE_BYTES:
+            raise ValueError(f'Line longer than {MAX_LINE_BYTES} bytes')
+    if buffer:
+        yield buffer
+
+async def _aiter(lines: Iterable[bytes]) -> AsyncIterator[bytes]:
+    for line in lines:
+        yield line
+
+def _validation_message(e: ValidationError) -> str:
+    return '; '.join(f"{'.'.join(map(str, err['loc'])) or 'record'}: {err['msg']}" for err in e.errors())
+
+class CourseImporter:
+    def __init__(self, collection, course_model, module_model, batch_size: int = 500):
+        self.collection = collection
+        self.course_model = course_model
+        self.module_model = module_model
+        self.batch_size = batch_size
+
+    def operations(self, record: dict) -> Tuple[str, List[UpdateOne]]:
+        if 'course_id' in record:
+            course_id = record['course_id']
+            if not isinstance(course_id, str):
+                raise ValueError('course_id: must be a string')
+            module = self.module_model(**record).model_dump()
+            # In-place replacement if the module exists, append otherwise; exactly one of the two matches.
+            return 'module', [
+                UpdateOne({'id': course_id, 'modules.id': module['id']}, {'$set': {'modules.$': module}}),
+                UpdateOne({'id': course_id, 'modules.id': {'$ne': module['id']}}, {'$push': {'modules': module}}),
+            ]
+        course = self.course_model(**{'created_at': datetime.now(timezone.utc).isoformat(), 'modules': [],
+                                      **record}).model_dump()
+        # Defaults only apply to new courses, so a re-import never resets what is stored.
+        defaults = {field: course.pop(field) for field in list(course) if field not in record}
+        update = {'$set': course}
+        if defaults:
+            update['$setOnInsert'] = defaults
+        return 'course', [UpdateOne({'id': course['id']}, update, upsert=True)]
+
+    async def run(self, lines: AsyncIterable[bytes]) -> ImportReport:
+        report = ImportReport()
+        batch: List[UpdateOne] = []
+        # Line number of every operation in the batch, to attribute write errors.
+        origins: List[int] = []
+        try:
+            async for raw in lines:
+                report.lines += 1
+                if not raw.strip():
+                    continue
+                try:
+                    record = json.loads(raw)
+                    if not isinstance(record, dict):
+                        raise ValueError('record: must be a JSON object')
+                    kind, ops = self.operations(record)
+                except ValidationError as e:
+                    report.error(report.lines, _validation_message(e))
+                    continue
+                except ValueError as e:
+                    report.error(report.lines, str(e))
+                    continue
+                if kind == 'course':
+                    report.courses += 1
+                else:
+                    report.modules += 1
+                batch.extend(ops)
+                origins.extend([report.lines] * len(ops))
+                if len(batch) >= self.batch_size:
+                    await self._flush(batch, origins, report)
+                    batch, origins = [], []
+        except ValueError as e:
+            # Raised by iter_lines for an oversized line; keep what was read so far.
+            report.error(report.lines + 1, str(e))
+        if batch:
+            await self._flush(batch, origins, report)
+        return report
+
+    async def _flush(self, batch: List[UpdateOne], origins: List[int], report: ImportReport):
+        # Ordered, so a module line sees the course line written before it.
+        while batch:
+            try:
+                result = await self.collection.bulk_write(batch, ordered=True)
+                done, failed = len(batch), None
+                matched, upserted = result.matched_count, result.upserted_count
+            except BulkWriteError as e:
+                failed = e.details['writeErrors'][0]
+                done = failed['index']
+                matched, upserted = e.details['nMatched'], e.details['nUpserted']
+                report.error(origins[done], failed.get('errmsg', 'write failed'))
+            report.created += upserted
+            # Every course op matches or upserts and every module pair matches once, if the course exists.
+            lines_done = len(set(origins[:done]))
+            report.unmatched_modules += max(lines_done - matched - upserted, 0)
+            if failed is None:
+                return
+            skip = done + 1
+            while skip < len(origins) and origins[skip] == origins[done]:
+                skip += 1
+            batch, origins = batch[skip:], origins[skip:]
+
+async def import_file(db, path: Path, course_model, module_model, batch_size: int = 500) -> ImportReport:
+    importer = CourseImporter(db.courses, course_model, module_model, batch_size)
+    with path.open('rb') as f:
+        return await importer.run(_aiter(f))
+
+async def main(args):
+    load_dotenv(Path(__file__).parent / '.env')
+    # The models live with the API; imported here so the server can import this module.
+    from server import Course, Module
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], uuidRepresentation='standard', tz_aware=True)
+    db = storage.wrap_database(client[os.environ['DB_NAME']], os.environ.get('STORAGE_FORMAT', storage.STRING))
+    report = await import_file(db, args.path, Course, Module, args.batch_size)
+    client.close()
+    print(json.dumps(report.as_dict(), indent=2))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import courses and modules from an NDJSON file.')
+    parser.add_argument('path', type=Path)
+    parser.add_argument('--batch-size', type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
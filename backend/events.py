@@ -0,0 +1,104 @@
+"""In-process pub/sub for server-sent events.
+
+Handlers ``publish`` small JSON events to topics (``user:<id>`` for coin and
+session changes, ``leaderboard`` for ranking changes) and every open
+``/api/events`` connection subscribed to that topic receives them.
+
+Publishing never blocks: each subscription has a bounded queue, and a
+subscriber that falls behind has its backlog replaced by a single
+``resync`` event telling the client to re-fetch. An idle connection costs
+one queue and one suspended coroutine.
+
+The broker is per worker. With several workers an event only reaches
+connections served by the worker that handled the change, so clients
+should still re-fetch on reconnect and after ``resync``.
+"""
+import asyncio
+import json
+from typing import Dict, Iterable, Optional, Set
+
+RESYNC = {'type': 'resync'}
+
+class Subscription:
+    __slots__ = ('topics', 'queue', 'dropped')
+
+    def __init__(self, topics: Iterable[str], maxsize: int):
+        self.topics = tuple(topics)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class EventBroker:
+    def __init__(self, queue_size: int = 64):
+        self.queue_size = queue_size
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self._coalesced: Set[str] = set()
+
+    @property
+    def connections(self) -> int:
+        return len({sub for subs in self._topics.values() for sub in subs})
+
+    def has_subscribers(self, topic: str) -> bool:
+        return topic in self._topics
+
+    def subscribe(self, *topics: str) -> Subscription:
+        sub = Subscription(topics, self.queue_size)
+        for topic in topics:
+            self._topics.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        for topic in sub.topics:
+            subs = self._topics.get(topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._topics[topic]
+
+    def publish(self, topic: str, event: dict) -> int:
+        subs = self._topics.get(topic)
+        if not subs:
+            return 0
+        for sub in subs:
+            sub.offer(event)
+        return len(subs)
+
+    def publish_coalesced(self, topic: str, event: dict, delay: float = 1.0):
+        """Publish ``event`` once after ``delay``, however often it is requested meanwhile."""
+        if topic in self._coalesced or topic not in self._topics:
+            return
+        self._coalesced.add(topic)
+
+        def fire():
+            self._coalesced.discard(topic)
+            self.publish(topic, event)
+
+        asyncio.get_running_loop().call_later(delay, fire)
+
+def format_sse(event: dict) -> str:
+    return f'event: {event["type"]}\ndata: {json.dumps(event, separators=(",", ":"))}\n\n'
+
+async def stream(broker: EventBroker, sub: Subscription, heartbeat: float = 15.0):
+    """Yield SSE frames for ``sub`` until the client goes away."""
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            event = await sub.get(heartbeat)
+            # A comment line keeps proxies from closing an idle connection.
+            yield format_sse(event) if event is not None else ': keep-alive\n\n'
+    finally:
+        broker.unsubscribe(sub)
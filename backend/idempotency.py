@@ -0,0 +1,169 @@
+"""``Idempotency-Key`` support for mutating endpoints.
+
+The first request with a given key (scoped to route and user) runs the
+handler and stores its response; retries with the same key get the stored
+response back without running the handler again. Client errors (4xx) are
+stored too, since re-running would give the same answer; anything else
+releases the key so the retry runs normally.
+
+Keys live in the ``idempotency_keys`` collection, which expires them
+through a TTL index, and in a per-worker LRU whose entries are ignored once
+they are older than ``ttl``, like the records behind them. A duplicate that arrives
+while the original is still running waits for it: on the same worker
+through a shared future, across workers by polling the pending record.
+Reusing a key for a different request body is rejected with 422.
+"""
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
+
+def fingerprint(*parts: Any) -> str:
+    payload = json.dumps(jsonable_encoder(parts), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class IdempotencyStore:
+    def __init__(self, collection, ttl: float = 86400, lru_size: int = 10_000,
+                 pending_timeout: float = 30.0, wait_timeout: float = 10.0):
+        self.collection = collection
+        self.ttl = ttl
+        self.lru_size = lru_size
+        # A pending record older than this belongs to a request that died mid-way.
+        self.pending_timeout = pending_timeout
+        self.wait_timeout = wait_timeout
+        self._lru: "OrderedDict[str, dict]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index('created_at', expireAfterSeconds=int(self.ttl))
+
+    async def run(self, scope: str, key: str, request_fingerprint: str,
+                  handler: Callable[[], Awaitable[Any]]):
+        key_id = f'{scope}:{key}'
+        outcome = self._lru_get(key_id)
+        if outcome is not None:
+            return self._replay(outcome, request_fingerprint)
+        inflight = self._inflight.get(key_id)
+        if inflight is not None:
+            return self._replay(await asyncio.shield(inflight), request_fingerprint)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key_id] = future
+        try:
+            outcome = await self._claim(key_id, request_fingerprint)
+            if outcome is not None:
+                future.set_result(outcome)
+                return self._replay(outcome, request_fingerprint)
+            result, outcome = await self._execute(key_id, request_fingerprint, handler)
+            future.set_result(outcome)
+            return result
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                # Mark it retrieved: there may be nobody waiting on it.
+                future.exception()
+            raise
+        finally:
+            del self._inflight[key_id]
+
+    def _lru_get(self, key_id: str) -> Optional[dict]:
+        outcome = self._lru.get(key_id)
+        if outcome is None:
+            return None
+        if datetime.now(timezone.utc) - outcome['created_at'] > timedelta(seconds=self.ttl):
+            del self._lru[key_id]
+            return None
+        self._lru.move_to_end(key_id)
+        return outcome
+
+    def _lru_put(self, key_id: str, outcome: dict):
+        self._lru[key_id] = outcome
+        self._lru.move_to_end(key_id)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def _replay(self, outcome: dict, request_fingerprint: str):
+        if outcome['fingerprint'] != request_fingerprint:
+            raise HTTPException(status_code=422, detail='Idempotency-Key was already used for a different request')
+        if outcome['status'] >= 400:
+            raise HTTPException(status_code=outcome['status'], detail=outcome['body'].get('detail'))
+        return JSONResponse(outcome['body'], status_code=outcome['status'], headers={'Idempotent-Replayed': 'true'})
+
+    async def _claim(self, key_id: str, request_fingerprint: str) -> Optional[dict]:
+        """Reserve ``key_id``; returns a finished outcome if another request already ran it."""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_one({
+                '_id': key_id, 'state': 'pending', 'fingerprint': request_fingerprint,
+                'created_at': now, 'claimed_at': now,
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        delay = 0.05
+        while True:
+            record = await self.collection.find_one({'_id': key_id})
+            if record is None:
+                # Expired or released between our insert and read: try again from scratch.
+                return await self._claim(key_id, request_fingerprint)
+            if record['state'] == 'done':
+                outcome = {k: record[k] for k in ('fingerprint', 'status', 'body', 'created_at')}
+                if outcome['created_at'].tzinfo is None:
+                    outcome['created_at'] = outcome['created_at'].replace(tzinfo=timezone.utc)
+                self._lru_put(key_id, outcome)
+                return outcome
+            if record['fingerprint'] != request_fingerprint:
+                raise HTTPException(status_code=422, detail='Idempotency-Key was already used for a different request')
+            claimed_at = record['claimed_at']
+            if claimed_at.tzinfo is None:
+                claimed_at = claimed_at.replace(tzinfo=timezone.utc)
+            if datetime.now(timezone.utc) - claimed_at > timedelta(seconds=self.pending_timeout):
+                taken = await self.collection.update_one(
+                    {'_id': key_id, 'state': 'pending', 'claimed_at': record['claimed_at']},
+                    {'$set': {'claimed_at': datetime.now(timezone.utc)}},
+                )
+                if taken.modified_count:
+                    return None
+            if loop.time() >= deadline:
+                raise HTTPException(status_code=409, detail='A request with this Idempotency-Key is still in progress')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    async def _execute(self, key_id: str, request_fingerprint: str, handler):
+        # Close enough to the record's created_at for the LRU entry to expire with it.
+        started = datetime.now(timezone.utc)
+        try:
+            result = await handler()
+        except HTTPException as e:
+            if e.status_code >= 500:
+                await self.collection.delete_one({'_id': key_id})
+                raise
+            outcome = {'fingerprint': request_fingerprint, 'status': e.status_code, 'body': {'detail': e.detail},
+                       'created_at': started}
+            await self._store(key_id, outcome)
+            raise
+        except BaseException:
+            await self.collection.delete_one({'_id': key_id})
+            raise
+        outcome = {'fingerprint': request_fingerprint, 'status': 200, 'body': jsonable_encoder(result),
+                   'created_at': started}
+        await self._store(key_id, outcome)
+        return result, outcome
+
+    async def _store(self, key_id: str, outcome: dict):
+        await self.collection.update_one(
+            {'_id': key_id},
+            {'$set': {'state': 'done', 'status': outcome['status'], 'body': outcome['body'],
+                      'completed_at': datetime.now(timezone.utc)}},
+        )
+        self._lru_put(key_id, outcome)
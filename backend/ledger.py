@@ -0,0 +1,368 @@
+"""Append-only coin ledger.
+
+Every coin change is inserted into ``coin_ledger`` as
+``{id, user_id, delta, reason, at}``, and a user's balance is the sum of
+their entries: there is no ``$inc`` on the user document. ``users.coins``
+is a cache of that balance for the leaderboard to sort on, refreshed in
+the background by ``UserCoinsWriter``, at most once per user per
+interval however many coin changes arrive.
+
+``coin_snapshots`` holds one ``{_id: user_id, balance, as_of}`` document
+per user: the sum of that user's entries with ``at <= as_of``. A balance is
+the snapshot plus the entries after it, read through the
+``(user_id, at)`` index, so reads stay cheap however long the history
+grows. Snapshots only advance to ``now - lag``, which leaves time for
+entries stamped just before the cutoff to be inserted.
+
+``debit`` only appends a negative entry the balance covers. Debits carry a
+per-user ``debit_seq`` under a unique index, so two debits checked against
+the same balance cannot both be written.
+
+Coins held before the ledger existed are recorded as one
+``opening_balance`` entry per user by ``open_once``, which the server runs
+before serving.
+
+    python ledger.py snapshot [--lag 300]   # advance snapshots (run periodically)
+    python ledger.py reconcile [--fix]      # compare users.coins with the ledger
+    python ledger.py open                   # opening_balance entries for pre-ledger coins
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+OPENING_BALANCE = 'opening_balance'
+OPENED = 'opening_balances'
+DEFAULT_LAG = 300
+DUPLICATE_KEY = 11000
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+async def append(db, user_id: str, delta: int, reason: str, now: Optional[datetime] = None) -> dict:
+    return (await append_many(db, user_id, [(delta, reason)], now))[0]
+
+async def append_many(db, user_id: str, changes: List[Tuple[int, str]], now: Optional[datetime] = None) -> List[dict]:
+    """Insert one entry per ``(delta, reason)`` in ``changes`` with a single ``insert_many``."""
+    at = now or datetime.now(timezone.utc)
+    entries = [{'id': str(uuid.uuid4()), 'user_id': user_id, 'delta': delta, 'reason': reason, 'at': at}
+               for delta, reason in changes]
+    await db.coin_ledger.insert_many([{**entry} for entry in entries])
+    return entries
+
+async def debit(db, user_id: str, amount: int, reason: str, now: Optional[datetime] = None) -> Optional[dict]:
+    """Append ``-amount`` if the balance covers it; returns the entry, or None if it does not."""
+    while True:
+        # The last sequence number is read before the balance: a debit written in between
+        # takes that number, so ours is rejected and re-checked against the new balance.
+        last = await db.coin_ledger.find_one({'user_id': user_id, 'debit_seq': {'$exists': True}},
+                                             {'_id': 0, 'debit_seq': 1}, sort=[('debit_seq', -1)])
+        if (await balance(db, user_id))['balance'] < amount:
+            return None
+        entry = {'id': str(uuid.uuid4()), 'user_id': user_id, 'delta': -amount, 'reason': reason,
+                 'at': now or datetime.now(timezone.utc), 'debit_seq': (last['debit_seq'] if last else 0) + 1}
+        try:
+            await db.coin_ledger.insert_one({**entry})
+            return entry
+        except DuplicateKeyError:
+            continue
+
+async def _entry_sums(db, user_ids: List[str], snapshots: Dict[str, dict],
+                      cutoff: Optional[datetime] = None) -> Dict[str, int]:
+    """Sum each user's entries after their snapshot (and up to ``cutoff``) in one query."""
+    clauses = []
+    for user_id in user_ids:
+        at = {}
+        if user_id in snapshots:
+            at['$gt'] = snapshots[user_id]['as_of']
+        if cutoff is not None:
+            at['$lte'] = cutoff
+        clauses.append({'user_id': user_id, 'at': at} if at else {'user_id': user_id})
+    if not clauses:
+        return {}
+    rows = db.coin_ledger.aggregate([
+        {'$match': {'$or': clauses}},
+        {'$group': {'_id': '$user_id', 'sum': {'$sum': '$delta'}}},
+    ])
+    return {row['_id']: row['sum'] async for row in rows}
+
+async def _snapshots(db, user_ids: List[str]) -> Dict[str, dict]:
+    return {s['_id']: s async for s in db.coin_snapshots.find({'_id': {'$in': user_ids}})}
+
+async def balances(db, user_ids: List[str]) -> Dict[str, int]:
+    snapshots = await _snapshots(db, user_ids)
+    sums = await _entry_sums(db, user_ids, snapshots)
+    return {u: snapshots.get(u, {}).get('balance', 0) + sums.get(u, 0) for u in user_ids}
+
+async def balance(db, user_id: str) -> dict:
+    snapshots = await _snapshots(db, [user_id])
+    sums = await _entry_sums(db, [user_id], snapshots)
+    snapshot = snapshots.get(user_id)
+    return {
+        'balance': (snapshot['balance'] if snapshot else 0) + sums.get(user_id, 0),
+        'snapshot_as_of': snapshot['as_of'] if snapshot else None,
+    }
+
+async def entries(db, user_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  limit: int = 100) -> List[dict]:
+    at = {}
+    if start is not None:
+        at['$gte'] = start
+    if end is not None:
+        at['$lt'] = end
+    query = {'user_id': user_id, 'at': at} if at else {'user_id': user_id}
+    return await db.coin_ledger.find(query, {'_id': 0}).sort('at', -1).limit(limit).to_list(limit)
+
+async def window_totals(db, start: datetime, end: datetime, limit: int = 50) -> List[dict]:
+    """Coins earned per user in ``[start, end)``, highest first. Spending does not count against it."""
+    rows = db.coin_ledger.aggregate([
+        {'$match': {'at': {'$gte': start, '$lt': end}, 'delta': {'$gt': 0}, 'reason': {'$ne': OPENING_BALANCE}}},
+        {'$group': {'_id': '$user_id', 'coins_earned': {'$sum': '$delta'}}},
+        {'$sort': {'coins_earned': -1, '_id': 1}},
+        {'$limit': limit},
+    ])
+    return [{'user_id': row['_id'], 'coins_earned': row['coins_earned']} async for row in rows]
+
+async def _advance(db, user_ids: List[str], cutoff: datetime) -> int:
+    snapshots = await _snapshots(db, user_ids)
+    sums = await _entry_sums(db, user_ids, snapshots, cutoff)
+    ops = []
+    for user_id in user_ids:
+        snapshot = snapshots.get(user_id)
+        if snapshot is not None and snapshot['as_of'] >= cutoff:
+            continue
+        new_balance = (snapshot['balance'] if snapshot else 0) + sums.get(user_id, 0)
+        # Conditional on the snapshot we summed from, so a concurrent run cannot apply entries twice.
+        query = {'_id': user_id, 'as_of': snapshot['as_of']} if snapshot else {'_id': user_id}
+        ops.append(UpdateOne(query, {'$set': {'balance': new_balance, 'as_of': cutoff}}, upsert=snapshot is None))
+    if ops:
+        await db.coin_snapshots.bulk_write(ops, ordered=False)
+    return len(ops)
+
+async def take_snapshots(db, lag: float = DEFAULT_LAG, batch_size: int = 500,
+                         now: Optional[datetime] = None) -> int:
+    """Advance the snapshot of every user with entries since the last run to ``now - lag``."""
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(seconds=lag)
+    # BSON dates have millisecond precision; a finer cutoff would not survive the round trip.
+    cutoff = cutoff.replace(microsecond=cutoff.microsecond // 1000 * 1000)
+    last_run = await db.coin_snapshot_runs.find_one({'_id': 'latest'})
+    since = _utc(last_run['cutoff']) if last_run else EPOCH
+    if since >= cutoff:
+        return 0
+    active = db.coin_ledger.aggregate([
+        {'$match': {'at': {'$gt': since, '$lte': cutoff}}},
+        {'$group': {'_id': '$user_id'}},
+    ], allowDiskUse=True)
+    written = 0
+    batch: List[str] = []
+    async for row in active:
+        batch.append(row['_id'])
+        if len(batch) >= batch_size:
+            written += await _advance(db, batch, cutoff)
+            batch = []
+    if batch:
+        written += await _advance(db, batch, cutoff)
+    # Recorded last: an interrupted run is simply redone from the previous cutoff.
+    await db.coin_snapshot_runs.update_one(
+        {'_id': 'latest'}, {'$set': {'cutoff': cutoff, 'snapshots': written}}, upsert=True
+    )
+    return written
+
+async def _mismatches(db, users: List[dict]) -> List[dict]:
+    ledger = await balances(db, [u['id'] for u in users])
+    return [{'user_id': u['id'], 'coins': u.get('coins', 0), 'ledger': ledger[u['id']]}
+            for u in users if u.get('coins', 0) != ledger[u['id']]]
+
+async def _users(db, query: dict, batch_size: int):
+    batch = []
+    async for user in db.users.find(query, {'_id': 0, 'id': 1, 'coins': 1}):
+        batch.append(user)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def reconcile(db, fix: bool = False, settle: float = 5.0, batch_size: int = 500) -> List[dict]:
+    """Find users whose ``coins`` disagree with their ledger balance; ``fix`` sets them to it.
+
+    Mismatches are checked again after ``settle`` seconds, so balances that
+    ``UserCoinsWriter`` has not refreshed yet are not reported.
+    """
+    suspects = []
+    async for users in _users(db, {}, batch_size):
+        suspects.extend(await _mismatches(db, users))
+    if suspects and settle:
+        await asyncio.sleep(settle)
+        first = {m['user_id']: m['ledger'] - m['coins'] for m in suspects}
+        suspects = []
+        async for users in _users(db, {'id': {'$in': list(first)}}, batch_size):
+            suspects.extend(m for m in await _mismatches(db, users) if m['ledger'] - m['coins'] == first[m['user_id']])
+    if fix and suspects:
+        # Conditional on the value compared, so a refresh written meanwhile is kept.
+        await db.users.bulk_write([
+            UpdateOne({'id': m['user_id'], 'coins': m['coins']}, {'$set': {'coins': m['ledger']}}) for m in suspects
+        ], ordered=False)
+    return suspects
+
+async def open_balances(db, batch_size: int = 500, now: Optional[datetime] = None) -> int:
+    """Record coins held before the ledger existed as one ``opening_balance`` entry per user.
+
+    Only correct while ``users.coins`` still holds the full balance, so run it
+    through ``open_once``.
+    """
+    written = 0
+    async for users in _users(db, {}, batch_size):
+        ids = [u['id'] for u in users]
+        opened = set(await db.coin_ledger.distinct('user_id', {'user_id': {'$in': ids}, 'reason': OPENING_BALANCE}))
+        ledger = await balances(db, ids)
+        docs = []
+        for user in users:
+            delta = user.get('coins', 0) - ledger[user['id']]
+            if user['id'] not in opened and delta:
+                docs.append({'id': str(uuid.uuid4()), 'user_id': user['id'], 'delta': delta,
+                             'reason': OPENING_BALANCE, 'at': now or datetime.now(timezone.utc)})
+        if docs:
+            try:
+                await db.coin_ledger.insert_many(docs, ordered=False)
+                written += len(docs)
+            except BulkWriteError as e:
+                # The unique index on opening entries rejects users another run opened meanwhile.
+                if any(err.get('code') != DUPLICATE_KEY for err in e.details.get('writeErrors', [])):
+                    raise
+                written += e.details['nInserted']
+    return written
+
+async def open_once(db, stale: float = 600, poll: float = 1.0) -> bool:
+    """Run ``open_balances`` unless it already ran on this database; returns whether this call ran it.
+
+    One caller claims the run and the others wait for it to finish, taking it
+    over if the claim is older than ``stale`` seconds. Waiting keeps workers
+    from serving balances, and writing ledger entries ``users.coins`` does
+    not reflect, while the opening entries are computed.
+    """
+    runs = db.coin_snapshot_runs
+    while True:
+        run = await runs.find_one({'_id': OPENED})
+        now = datetime.now(timezone.utc)
+        if run is None:
+            try:
+                await runs.insert_one({'_id': OPENED, 'done': False, 'claimed_at': now})
+                break
+            except DuplicateKeyError:
+                continue
+        if run['done']:
+            return False
+        if now - _utc(run['claimed_at']) > timedelta(seconds=stale):
+            taken = await runs.update_one({'_id': OPENED, 'claimed_at': run['claimed_at']}, {'$set': {'claimed_at': now}})
+            if taken.modified_count:
+                logger.warning('Taking over opening balances claimed at %s', run['claimed_at'])
+                break
+            continue
+        await asyncio.sleep(poll)
+    written = await open_balances(db)
+    await runs.update_one({'_id': OPENED}, {'$set': {'done': True, 'opened': written}})
+    logger.info('Recorded %d opening balances', written)
+    return True
+
+class UserCoinsWriter:
+    """Copies ledger balances of recently changed users into ``users.coins``.
+
+    ``touch`` marks a user; every ``interval`` seconds the marked users'
+    balances are read with one ``balances`` query and written with one
+    ``bulk_write``. Writes are conditional on ``coins_as_of``, so a balance
+    read earlier never replaces one another worker read later.
+    """
+    def __init__(self, db, interval: float = 1.0, batch_size: int = 500):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, user_id: str):
+        self._dirty.add(user_id)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('%d users.coins not refreshed on shutdown', len(self._dirty))
+
+    async def flush(self) -> int:
+        written = 0
+        while self._dirty:
+            ids = list(itertools.islice(self._dirty, self.batch_size))
+            self._dirty.difference_update(ids)
+            # Taken before the read, so it never claims more than the read saw.
+            as_of = datetime.now(timezone.utc)
+            try:
+                fresh = await balances(self.db, ids)
+                await self.db.users.bulk_write([
+                    UpdateOne({'id': user_id, '$or': [{'coins_as_of': {'$lt': as_of}}, {'coins_as_of': None}]},
+                              {'$set': {'coins': coins, 'coins_as_of': as_of}})
+                    for user_id, coins in fresh.items()
+                ], ordered=False)
+            except Exception:
+                self._dirty.update(ids)
+                raise
+            written += len(ids)
+        return written
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Kept marked; the next round retries them.
+                logger.exception('Refreshing users.coins failed')
+
+async def main(args):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], uuidRepresentation='standard', tz_aware=True)
+    db = storage.wrap_database(client[os.environ['DB_NAME']], os.environ.get('STORAGE_FORMAT', storage.STRING))
+    if args.command == 'snapshot':
+        print(f'Advanced {await take_snapshots(db, lag=args.lag)} coin snapshots')
+    elif args.command == 'reconcile':
+        mismatches = await reconcile(db, fix=args.fix)
+        for m in mismatches:
+            print(f"{m['user_id']}: users.coins={m['coins']} ledger={m['ledger']}")
+        print(f"{len(mismatches)} mismatched balances{' fixed' if args.fix and mismatches else ''}")
+    elif await open_once(db):
+        print(f"Recorded {(await db.coin_snapshot_runs.find_one({'_id': OPENED}))['opened']} opening balances")
+    else:
+        print('Opening balances were already recorded')
+    client.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Coin ledger maintenance.')
+    parser.add_argument('command', choices=['snapshot', 'reconcile', 'open'])
+    parser.add_argument('--lag', type=float, default=DEFAULT_LAG, help='seconds behind now to snapshot up to')
+    parser.add_argument('--fix', action='store_true', help='correct users.coins to the ledger balance')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,128 @@
+"""Token-bucket rate limiting for the expensive routes.
+
+Each limit allows ``capacity`` requests in a burst, refilled continuously
+over ``period`` seconds. Buckets are keyed by ``<limit name>:<user id or
+client ip>``. Behind a proxy, run uvicorn with ``--proxy-headers`` so the
+client ip is the real one.
+
+Two stores are available (``RATE_LIMIT_STORE``):
+
+* ``memory`` (default) - per worker; two floats per key in an LRU that
+  drops keys once they have been idle long enough to be full again.
+* ``mongo`` - shared by all workers through one atomic pipeline update per
+  hit on the ``rate_limits`` collection; idle keys expire via a TTL index.
+"""
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from pymongo import ReturnDocument
+
+class Limit(NamedTuple):
+    capacity: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+DEFAULT_LIMITS = {
+    'login': Limit(10, 60),
+    'signup': Limit(5, 300),
+    'recommendations': Limit(5, 60),
+}
+
+def parse_limits(spec: Optional[str]) -> Dict[str, Limit]:
+    """Parse ``"login=10/60,signup=5/300"`` on top of ``DEFAULT_LIMITS``."""
+    limits = dict(DEFAULT_LIMITS)
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, value = item.partition('=')
+        capacity, _, period = value.partition('/')
+        try:
+            limit = Limit(int(capacity), float(period))
+        except ValueError:
+            limit = None
+        # A zero capacity or period would divide by zero in Limit.rate.
+        if not name.strip() or limit is None or limit.capacity < 1 or not 0 < limit.period < math.inf:
+            raise ValueError(f'Invalid RATE_LIMITS entry {item!r}: expected <name>=<requests>/<seconds> '
+                             f'with at least 1 request and a positive period, e.g. login=10/60')
+        limits[name.strip()] = limit
+    return limits
+
+class MemoryBucketStore:
+    def __init__(self, idle_after: float = 300.0, max_keys: int = 100_000):
+        # A bucket idle for its longest refill period is full again, i.e. the same as absent.
+        self.idle_after = idle_after
+        self.max_keys = max_keys
+        # key -> [tokens, updated_at]; least recently used first.
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _evict(self, now: float):
+        # Amortised O(1): a few stale keys are dropped from the cold end per hit.
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, (_, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < self.idle_after and len(self._buckets) <= self.max_keys:
+                return
+            del self._buckets[key]
+
+    async def acquire(self, key: str, limit: Limit, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(limit.capacity), now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(limit.capacity, bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+        self._evict(now)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / limit.rate
+
+class MongoBucketStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    async def acquire(self, key: str, limit: Limit) -> float:
+        # $$NOW is the server clock, so workers with skewed clocks agree.
+        elapsed = {'$divide': [{'$subtract': ['$$NOW', {'$ifNull': ['$updated_at', '$$NOW']}]}, 1000]}
+        refilled = {'$add': [{'$ifNull': ['$tokens', limit.capacity]}, {'$multiply': [elapsed, limit.rate]}]}
+        bucket = await self.collection.find_one_and_update(
+            {'_id': key},
+            [
+                {'$set': {'tokens': {'$min': [limit.capacity, refilled]}, 'updated_at': '$$NOW'}},
+                {'$set': {
+                    'allowed': {'$gte': ['$tokens', 1]},
+                    'tokens': {'$cond': [{'$gte': ['$tokens', 1]}, {'$subtract': ['$tokens', 1]}, '$tokens']},
+                    'expires_at': {'$add': ['$$NOW', int(limit.period * 1000)]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket['allowed']:
+            return 0.0
+        return (1 - bucket['tokens']) / limit.rate
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, Limit], store=None):
+        self.limits = limits
+        self.store = store or MemoryBucketStore(idle_after=max((l.period for l in limits.values()), default=0))
+
+    async def hit(self, name: str, key: str) -> int:
+        """Take one token; returns 0 if allowed, else the seconds to wait."""
+        limit = self.limits.get(name)
+        if limit is None:
+            return 0
+        retry_after = await self.store.acquire(f'{name}:{key}', limit)
+        return math.ceil(retry_after) if retry_after > 0 else 0
@@ -1,16 +1,29 @@
+import argparse
 import asyncio
+import itertools
+import json
+import random
+import time
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 from dotenv import load_dotenv
 from pathlib import Path
 import uuid
+from datetime import datetime, timezone, timedelta
+import bcrypt
+
+import ledger
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = None
+db = None
+
+def connect():
+    global client, db
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
 
 async def seed_courses():
     existing = await db.courses.count_documents({})
@@ -169,11 +182,316 @@ async def seed_rewards():
     await db.rewards.insert_many(rewards)
     print(f'Seeded {len(rewards)} rewards')
 
-async def main():
-    await seed_courses()
+# --- Synthetic data for capacity testing -------------------------------------
+
+SYNTHETIC_COLLECTIONS = ['courses', 'users', 'enrollments', 'quiz_attempts', 'p2p_sessions']
+LEDGER_COLLECTIONS = ['coin_ledger', 'coin_snapshots', 'coin_snapshot_runs']
+SYNTHETIC_PASSWORD = 'password123'
+
+TOPICS = ['Python', 'JavaScript', 'Data Science', 'Machine Learning', 'Web Design', 'SQL', 'Statistics',
+          'Cloud Computing', 'Cybersecurity', 'Mobile Development', 'DevOps', 'Algorithms', 'Rust', 'Go',
+          'UX Research', 'Product Management', 'Digital Marketing', 'Photography', 'Music Theory', 'Spanish']
+LEVELS = ['for Beginners', 'Fundamentals', 'Essentials', 'in Practice', 'Deep Dive', 'Masterclass', 'Bootcamp']
+MODULE_TITLES = ['Introduction', 'Core Concepts', 'Hands-on Project', 'Common Pitfalls', 'Best Practices',
+                 'Tooling', 'Case Study', 'Advanced Topics', 'Review']
+FIRST_NAMES = ['Aarav', 'Priya', 'Liam', 'Olivia', 'Noah', 'Emma', 'Wei', 'Mei', 'Kofi', 'Amara', 'Mateo',
+               'Sofia', 'Yuki', 'Hiro', 'Fatima', 'Omar', 'Lena', 'Jonas', 'Ananya', 'Rohan']
+SKILLS = ['Python', 'JavaScript', 'React', 'SQL', 'Excel', 'Guitar', 'Spanish', 'Design', 'Statistics', 'Writing']
+
+class SyntheticConfig:
+    def __init__(self, users, courses, enrollments, quiz_attempts, p2p_sessions, seed=42,
+                 zipf_s=1.1, coin_alpha=1.2, mentor_fraction=0.05):
+        self.users = users
+        self.courses = courses
+        self.enrollments = enrollments
+        self.quiz_attempts = quiz_attempts
+        self.p2p_sessions = p2p_sessions
+        self.seed = seed
+        self.zipf_s = zipf_s
+        self.coin_alpha = coin_alpha
+        self.mentor_fraction = mentor_fraction
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _user_id(seed: int, n: int) -> str:
+    # Derivable from the index so sessions can reference users without keeping millions of ids around.
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'm2-synthetic/{seed}/user/{n}'))
+
+def synthetic_password_hash(seed: int) -> str:
+    # A fixed salt keeps exports byte-identical per seed; one hash is shared by every synthetic user.
+    rng = random.Random(seed)
+    alphabet = './ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+    salt = '$2b$12$' + ''.join(rng.choice(alphabet) for _ in range(21)) + '.'
+    return bcrypt.hashpw(SYNTHETIC_PASSWORD.encode('utf-8'), salt.encode('utf-8')).decode('utf-8')
+
+def _zipf_cum_weights(n: int, s: float):
+    return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+def _poisson(rng: random.Random, mean: float) -> int:
+    # Knuth's method for small means, normal approximation otherwise.
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        return max(0, int(round(rng.gauss(mean, mean ** 0.5))))
+    limit, k, p = pow(2.718281828459045, -mean), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat()
+
+def generate_courses(cfg: SyntheticConfig, rng: random.Random, epoch: datetime):
+    courses = []
+    for i in range(cfg.courses):
+        modules = []
+        for m in range(rng.randint(2, 6)):
+            questions = []
+            for q in range(rng.randint(2, 4)):
+                options = [f'Option {chr(65 + o)}' for o in range(rng.randint(2, 4))]
+                questions.append({'question': f'Question {q + 1}', 'options': options,
+                                  'correct_answer': rng.choice(options)})
+            modules.append({'id': _uuid(rng), 'title': MODULE_TITLES[m % len(MODULE_TITLES)],
+                            'video_url': 'https://www.youtube.com/embed/kqtD5dpn9C8', 'questions': questions})
+        topic = TOPICS[i % len(TOPICS)]
+        courses.append({
+            'id': _uuid(rng),
+            'title': f'{topic} {rng.choice(LEVELS)} #{i + 1}',
+            'description': f'Synthetic {topic} course generated for capacity testing.',
+            'thumbnail': 'https://images.unsplash.com/photo-1526379095098-d400fd0bf935?w=400',
+            'coin_reward': rng.choice([100, 150, 200, 250]),
+            'modules': modules,
+            'created_at': _iso(epoch + timedelta(minutes=i)),
+        })
+    return courses
+
+def generate_synthetic(cfg: SyntheticConfig, password_hash: str):
+    """Yield ``(collection, document)`` pairs deterministically for ``cfg.seed``.
+
+    Course popularity follows a Zipf distribution (rank ``r`` is picked with
+    weight ``1 / r**zipf_s``) and coin balances a Pareto distribution, so a
+    handful of courses and users dominate as they do in production. Counts for
+    enrollments, attempts and sessions are targets; the actual totals land
+    within a few percent of them.
+    """
+    rng = random.Random(cfg.seed)
+    now = datetime(2026, 6, 1, tzinfo=timezone.utc)
+    epoch = now - timedelta(days=365)
+
+    courses = generate_courses(cfg, rng, epoch)
+    for course in courses:
+        yield 'courses', course
+    # Popularity rank is independent of creation order.
+    by_rank = courses[:]
+    rng.shuffle(by_rank)
+    course_weights = _zipf_cum_weights(len(by_rank), cfg.zipf_s)
+
+    mentor_count = max(1, int(cfg.users * cfg.mentor_fraction)) if cfg.p2p_sessions else 0
+    enrollments_per_user = cfg.enrollments / cfg.users if cfg.users else 0
+    attempts_per_enrollment = cfg.quiz_attempts / cfg.enrollments if cfg.enrollments else 0
+    for n in range(cfg.users):
+        user_id = _user_id(cfg.seed, n)
+        created = epoch + timedelta(seconds=rng.randrange(365 * 86400))
+        skills = rng.sample(SKILLS, rng.randint(1, 3)) if n < mentor_count else []
+        completed_courses = 0
+        k = min(_poisson(rng, enrollments_per_user), len(by_rank))
+        chosen = set()
+        while len(chosen) < k:
+            chosen.add(rng.choices(range(len(by_rank)), cum_weights=course_weights)[0])
+        for rank in sorted(chosen):
+            course = by_rank[rank]
+            enrolled = created + timedelta(seconds=rng.randrange(max(1, int((now - created).total_seconds()))))
+            completed_modules = []
+            for a in range(_poisson(rng, attempts_per_enrollment)):
+                module = rng.choice(course['modules'])
+                score = rng.choice([0, 25, 50, 66.66666666666666, 75, 100])
+                passed = score >= 70
+                if passed and module['id'] not in completed_modules:
+                    completed_modules.append(module['id'])
+                yield 'quiz_attempts', {
+                    'id': _uuid(rng),
+                    'user_id': user_id,
+                    'module_id': module['id'],
+                    'course_id': course['id'],
+                    'score': score,
+                    'passed': passed,
+                    'completed_at': _iso(enrolled + timedelta(minutes=10 * (a + 1))),
+                }
+            progress = len(completed_modules) / len(course['modules']) * 100
+            coins_earned = 20 * len(completed_modules)
+            if progress >= 100:
+                completed_courses += 1
+                coins_earned = max(coins_earned, course['coin_reward'])
+            yield 'enrollments', {
+                'id': _uuid(rng),
+                'user_id': user_id,
+                'course_id': course['id'],
+                'progress': progress,
+                'completed_modules': completed_modules,
+                'coins_earned': coins_earned,
+                'enrolled_at': _iso(enrolled),
+            }
+        yield 'users', {
+            'id': user_id,
+            'email': f'user{n}@synthetic.m2.test',
+            'name': f'{rng.choice(FIRST_NAMES)} {n}',
+            'password_hash': password_hash,
+            'coins': min(int((rng.paretovariate(cfg.coin_alpha) - 1) * 40), 1_000_000),
+            'streak_count': 0,
+            'last_activity': None,
+            'skills_can_teach': skills,
+            'total_courses_completed': completed_courses,
+            'total_sessions_completed': 0,
+            'created_at': _iso(created),
+        }
+
+    if mentor_count and cfg.users > 1:
+        mentor_weights = _zipf_cum_weights(mentor_count, cfg.zipf_s)
+        for _ in range(cfg.p2p_sessions):
+            mentor = rng.choices(range(mentor_count), cum_weights=mentor_weights)[0]
+            learner = rng.randrange(cfg.users - 1)
+            if learner >= mentor:
+                learner += 1
+            created = epoch + timedelta(seconds=rng.randrange(365 * 86400))
+            rated = created < now - timedelta(days=7) and rng.random() < 0.7
+            yield 'p2p_sessions', {
+                'id': _uuid(rng),
+                'mentor_id': _user_id(cfg.seed, mentor),
+                'learner_id': _user_id(cfg.seed, learner),
+                'skill': rng.choice(SKILLS),
+                'scheduled_at': _iso(created + timedelta(days=rng.randint(1, 14))),
+                'status': 'completed' if rated else 'scheduled',
+                'rating': rng.randint(3, 5) if rated else None,
+                'feedback': None,
+                'created_at': _iso(created),
+            }
+
+class _Progress:
+    def __init__(self, every: float = 2.0):
+        self.every = every
+        self.counts = {name: 0 for name in SYNTHETIC_COLLECTIONS}
+        self.started = time.monotonic()
+        self._last = self.started
+
+    def add(self, collection: str, n: int):
+        self.counts[collection] += n
+        now = time.monotonic()
+        if now - self._last >= self.every:
+            self._last = now
+            self.report()
+
+    def report(self, final: bool = False):
+        elapsed = time.monotonic() - self.started
+        total = sum(self.counts.values())
+        counts = ', '.join(f'{k}={v:,}' for k, v in self.counts.items())
+        print(f'{"Done" if final else "..."} {counts} ({total / max(elapsed, 1e-9):,.0f} docs/s, {elapsed:.1f}s)', flush=True)
+
+async def seed_synthetic(cfg: SyntheticConfig, batch_size: int = 5000, concurrency: int = 8, drop: bool = False):
+    if drop:
+        for name in SYNTHETIC_COLLECTIONS + LEDGER_COLLECTIONS:
+            await db[name].drop()
+    password_hash = synthetic_password_hash(cfg.seed)
+    progress = _Progress()
+    slots = asyncio.Semaphore(concurrency)
+    pending = set()
+    batches = {name: [] for name in SYNTHETIC_COLLECTIONS}
+
+    async def write(name, docs):
+        try:
+            await db[name].insert_many(docs, ordered=False)
+            progress.add(name, len(docs))
+        finally:
+            slots.release()
+
+    failed = []
+
+    def finished(task):
+        pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            failed.append(task.exception())
+
+    async def flush(name):
+        docs, batches[name] = batches[name], []
+        # Waiting for a free slot is the backpressure on the (synchronous) generator.
+        await slots.acquire()
+        if failed:
+            slots.release()
+            raise failed[0]
+        task = asyncio.create_task(write(name, docs))
+        pending.add(task)
+        task.add_done_callback(finished)
+
+    try:
+        for name, doc in generate_synthetic(cfg, password_hash):
+            batches[name].append(doc)
+            if len(batches[name]) >= batch_size:
+                await flush(name)
+        for name in SYNTHETIC_COLLECTIONS:
+            if batches[name]:
+                await flush(name)
+    finally:
+        # Let batches already in flight finish (or fail) before reporting.
+        await asyncio.gather(*pending, return_exceptions=True)
+    if failed:
+        raise failed[0]
+    progress.report(final=True)
+    # Balances are read from the ledger, so the seeded coins have to be recorded there.
+    print(f'Recorded {await ledger.open_balances(db)} opening balances', flush=True)
+
+def export_synthetic(cfg: SyntheticConfig, out_dir: Path):
+    """Write one NDJSON file per collection instead of talking to MongoDB."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    password_hash = synthetic_password_hash(cfg.seed)
+    progress = _Progress()
+    files = {name: open(out_dir / f'{name}.ndjson', 'w') for name in SYNTHETIC_COLLECTIONS}
+    try:
+        for name, doc in generate_synthetic(cfg, password_hash):
+            files[name].write(json.dumps(doc, separators=(',', ':')) + '\n')
+            progress.add(name, 1)
+    finally:
+        for f in files.values():
+            f.close()
+    progress.report(final=True)
+
+def synthetic_config(args) -> SyntheticConfig:
+    return SyntheticConfig(args.users, args.courses, args.enrollments, args.quiz_attempts, args.sessions,
+                           seed=args.seed, zipf_s=args.zipf_s, coin_alpha=args.coin_alpha)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Seed the M2 database with demo or synthetic data.')
+    parser.add_argument('--synthetic', action='store_true',
+                        help='generate a large synthetic dataset instead of the demo catalog')
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--courses', type=int, default=200)
+    parser.add_argument('--enrollments', type=int, default=30_000)
+    parser.add_argument('--quiz-attempts', type=int, default=100_000)
+    parser.add_argument('--sessions', type=int, default=5_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--zipf-s', type=float, default=1.1, help='course popularity skew')
+    parser.add_argument('--coin-alpha', type=float, default=1.2, help='Pareto shape of coin balances')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8, help='insert_many batches in flight')
+    parser.add_argument('--drop', action='store_true', help='drop the synthetic collections first')
+    parser.add_argument('--out', type=Path, help='write NDJSON files to this directory instead of MongoDB')
+    return parser.parse_args(argv)
+
+async def main(args):
+    connect()
+    if args.synthetic:
+        await seed_synthetic(synthetic_config(args), batch_size=args.batch_size,
+                             concurrency=args.concurrency, drop=args.drop)
+    else:
+        await seed_courses()
     await seed_rewards()
     client.close()
     print('Database seeded successfully!')
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    args = parse_args()
+    if args.synthetic and args.out:
+        export_synthetic(synthetic_config(args), args.out)
+    else:
+        asyncio.run(main(args))
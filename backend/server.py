@@ -1,33 +1,65 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+import streaks
+import analytics
+import storage
+import events
+import idempotency
+import course_import
+from catalog import CatalogCache
+import ledger
+from rate_limit import RateLimiter, MongoBucketStore, parse_limits
+from write_behind import WriteBehindBuffer, WriteBehindFull
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Opened per worker by the lifespan handler, after any pre-fork.
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+STARTUP_METRICS: Dict[str, float] = {}
+
+# quiz_attempts is append-only and never read on the request path.
+quiz_attempt_writer: Optional[WriteBehindBuffer] = None
+coins_writer: Optional[ledger.UserCoinsWriter] = None
+idempotency_store: Optional[idempotency.IdempotencyStore] = None
 
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
+broker = events.EventBroker(queue_size=int(os.environ.get('EVENT_QUEUE_SIZE', '64')))
+
 JWT_SECRET = os.environ.get('JWT_SECRET', 'fallback_secret')
 JWT_ALGORITHM = 'HS256'
 security = HTTPBearer()
 
+EVENT_TOKEN_TTL = int(os.environ.get('EVENT_TOKEN_TTL', '60'))
+
 def create_token(user_id: str) -> str:
     payload = {
         'user_id': user_id,
@@ -35,9 +67,23 @@ def create_token(user_id: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+def create_event_token(user_id: str) -> str:
+    # Only good for opening /events, and short-lived, since it travels in the URL.
+    payload = {
+        'user_id': user_id,
+        'scope': 'events',
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=EVENT_TOKEN_TTL)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await user_from_token(credentials.credentials)
+
+async def user_from_token(token: str, scope: Optional[str] = None) -> dict:
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        if payload.get('scope') != scope:
+            raise HTTPException(status_code=401, detail='Invalid token')
         user = await db.users.find_one({'id': payload['user_id']}, {'_id': 0})
         if not user:
             raise HTTPException(status_code=401, detail='User not found')
@@ -47,10 +93,44 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail='Invalid token')
 
+ADMIN_EMAILS = {e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()}
+
+async def get_admin_user(user=Depends(get_current_user)):
+    if user['email'].lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail='Admin access required')
+    return user
+
+rate_limiter = RateLimiter(parse_limits(os.environ.get('RATE_LIMITS')))
+
+async def _enforce_rate_limit(name: str, key: str):
+    retry_after = await rate_limiter.hit(name, key)
+    if retry_after:
+        raise HTTPException(status_code=429, detail='Too many requests',
+                            headers={'Retry-After': str(retry_after)})
+
+def limit_by_ip(name: str):
+    async def dependency(request: Request):
+        await _enforce_rate_limit(name, request.client.host if request.client else 'unknown')
+    return dependency
+
+def limit_by_user(name: str):
+    async def dependency(user=Depends(get_current_user)):
+        await _enforce_rate_limit(name, user['id'])
+        return user
+    return dependency
+
+async def run_idempotent(key: Optional[str], route: str, user: dict, handler, *request_parts):
+    if key is None:
+        return await handler()
+    if not key or len(key) > 255:
+        raise HTTPException(status_code=400, detail='Idempotency-Key must be 1-255 characters')
+    return await idempotency_store.run(f'{route}:{user["id"]}', key, idempotency.fingerprint(*request_parts), handler)
+
 class SignupRequest(BaseModel):
     email: EmailStr
     password: str
     name: str
+    timezone: Optional[str] = None
 
 class LoginRequest(BaseModel):
     email: EmailStr
@@ -63,7 +143,9 @@ class UserProfile(BaseModel):
     name: str
     coins: int = 0
     streak_count: int = 0
+    longest_streak: int = 0
     last_activity: Optional[str] = None
+    timezone: str = streaks.DEFAULT_TIMEZONE
     skills_can_teach: List[str] = []
     total_courses_completed: int = 0
     total_sessions_completed: int = 0
@@ -99,9 +181,15 @@ class QuizSubmission(BaseModel):
     course_id: str
     answers: List[Dict]
 
+class QuizBatchSubmission(BaseModel):
+    submissions: List[QuizSubmission]
+
 class SkillRequest(BaseModel):
     skill: str
 
+class TimezoneRequest(BaseModel):
+    timezone: str
+
 class SessionBooking(BaseModel):
     mentor_id: str
     skill: str
@@ -115,11 +203,110 @@ class SessionRating(BaseModel):
 class RewardRedemption(BaseModel):
     reward_id: str
 
-@api_router.post('/auth/signup')
+catalog = CatalogCache(ttl=float(os.environ.get('CATALOG_CACHE_TTL', '60')))
+
+INDEXES = [
+    ('users', [('id', ASCENDING)], {'unique': True}),
+    ('users', [('email', ASCENDING)], {'unique': True}),
+    ('users', [('coins', DESCENDING)], {}),
+    ('users', [('skills_can_teach', ASCENDING)], {}),
+    ('users', [('streak_count', DESCENDING)], {}),
+    ('users', [('last_activity', ASCENDING)], {'partialFilterExpression': {'streak_count': {'$gt': 0}}}),
+    ('courses', [('id', ASCENDING)], {'unique': True}),
+    ('enrollments', [('user_id', ASCENDING), ('course_id', ASCENDING)], {}),
+    ('quiz_attempts', [('id', ASCENDING)], {'unique': True}),
+    ('quiz_attempts', [('user_id', ASCENDING), ('completed_at', DESCENDING)], {}),
+    ('p2p_sessions', [('id', ASCENDING)], {'unique': True}),
+    ('p2p_sessions', [('mentor_id', ASCENDING)], {}),
+    ('p2p_sessions', [('learner_id', ASCENDING)], {}),
+    ('rewards', [('id', ASCENDING)], {'unique': True}),
+    ('user_rewards', [('user_id', ASCENDING)], {}),
+    ('coin_ledger', [('user_id', ASCENDING), ('at', ASCENDING)], {}),
+    ('coin_ledger', [('at', ASCENDING)], {}),
+    ('coin_ledger', [('user_id', ASCENDING), ('debit_seq', DESCENDING)],
+     {'unique': True, 'partialFilterExpression': {'debit_seq': {'$exists': True}}}),
+    ('coin_ledger', [('user_id', ASCENDING)], {'unique': True, 'partialFilterExpression': {'reason': ledger.OPENING_BALANCE}}),
+]
+
+async def ensure_indexes():
+    for collection, keys, options in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            # Pre-existing duplicates must not keep the worker from booting.
+            logger.warning('Could not create index %s on %s: %s', keys, collection, e)
+
+def user_profile(user: dict) -> UserProfile:
+    return UserProfile(**{**user, 'streak_count': streaks.effective_streak(user)})
+
+# Tells cheaply whether a coin change can move the top of the leaderboard.
+class LeaderboardWatch:
+    def __init__(self, size: int = 50, ttl: float = 5.0):
+        self.size = size
+        self.ttl = ttl
+        self._ids = set()
+        self._floor = 0
+        self._loaded_at: Optional[float] = None
+
+    async def _refresh(self):
+        top = await db.users.find({}, {'_id': 0, 'id': 1, 'coins': 1}).sort('coins', -1).limit(self.size).to_list(self.size)
+        self._ids = {u['id'] for u in top}
+        self._floor = top[-1]['coins'] if len(top) == self.size else None
+        self._loaded_at = time.monotonic()
+
+    async def coins_changed(self, user_id: str, coins: int):
+        if not broker.has_subscribers('leaderboard'):
+            return
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+            await self._refresh()
+        # Judged against the cached top until the TTL runs out; the event itself is coalesced.
+        if user_id in self._ids or self._floor is None or coins > self._floor:
+            broker.publish_coalesced('leaderboard', {'type': 'leaderboard'})
+
+leaderboard_watch = LeaderboardWatch()
+
+async def add_coins(user_id: str, delta: int, reason: str, extra_inc: Optional[Dict[str, int]] = None) -> int:
+    return await add_coin_entries(user_id, [(delta, reason)], extra_inc)
+
+async def add_coin_entries(user_id: str, changes: List[Tuple[int, str]],
+                           extra_inc: Optional[Dict[str, int]] = None) -> int:
+    # The ledger is the balance; users.coins is refreshed from it in the background.
+    await ledger.append_many(db, user_id, changes)
+    if extra_inc:
+        await db.users.update_one({'id': user_id}, {'$inc': extra_inc})
+    return await coins_changed(user_id, changes)
+
+async def coins_changed(user_id: str, changes: List[Tuple[int, str]]) -> int:
+    coins_writer.touch(user_id)
+    coins = (await ledger.balance(db, user_id))['balance']
+    for delta, reason in changes:
+        broker.publish(f'user:{user_id}', {'type': 'coins', 'coins': coins, 'delta': delta, 'reason': reason})
+    await leaderboard_watch.coins_changed(user_id, coins)
+    return coins
+
+def notify_session(action: str, session: dict):
+    event = {'type': 'session', 'action': action, 'session': session}
+    broker.publish(f"user:{session['mentor_id']}", event)
+    broker.publish(f"user:{session['learner_id']}", event)
+
+def grade_answers(module: dict, answers: List[Dict]) -> List[bool]:
+    return [
+        i < len(answers) and answers[i].get('answer') == question.get('correct_answer')
+        for i, question in enumerate(module['questions'])
+    ]
+
+def _llm_chat():
+    # Imported on first use: the LLM client stack is by far the slowest import.
+    from emergentintegrations.llm.chat import LlmChat, UserMessage
+    return LlmChat, UserMessage
+
+@api_router.post('/auth/signup', dependencies=[Depends(limit_by_ip('signup'))])
 async def signup(req: SignupRequest):
     existing = await db.users.find_one({'email': req.email}, {'_id': 0})
     if existing:
         raise HTTPException(status_code=400, detail='Email already registered')
+    if req.timezone and not streaks.is_valid_timezone(req.timezone):
+        raise HTTPException(status_code=400, detail='Unknown timezone')
     
     hashed_pw = bcrypt.hashpw(req.password.encode('utf-8'), bcrypt.gensalt())
     user_id = str(uuid.uuid4())
@@ -130,7 +317,9 @@ async def signup(req: SignupRequest):
         'password_hash': hashed_pw.decode('utf-8'),
         'coins': 0,
         'streak_count': 0,
+        'longest_streak': 0,
         'last_activity': None,
+        'timezone': req.timezone or streaks.DEFAULT_TIMEZONE,
         'skills_can_teach': [],
         'total_courses_completed': 0,
         'total_sessions_completed': 0,
@@ -138,9 +327,9 @@ async def signup(req: SignupRequest):
     }
     await db.users.insert_one(user)
     token = create_token(user_id)
-    return {'token': token, 'user': UserProfile(**user)}
+    return {'token': token, 'user': user_profile(user)}
 
-@api_router.post('/auth/login')
+@api_router.post('/auth/login', dependencies=[Depends(limit_by_ip('login'))])
 async def login(req: LoginRequest):
     user = await db.users.find_one({'email': req.email}, {'_id': 0})
     if not user:
@@ -150,27 +339,50 @@ async def login(req: LoginRequest):
         raise HTTPException(status_code=401, detail='Invalid credentials')
     
     token = create_token(user['id'])
-    return {'token': token, 'user': UserProfile(**user)}
+    return {'token': token, 'user': user_profile(user)}
 
 @api_router.get('/users/me', response_model=UserProfile)
 async def get_profile(user=Depends(get_current_user)):
-    return UserProfile(**user)
+    # users.coins can trail the ledger by a refresh interval.
+    return user_profile({**user, 'coins': (await ledger.balance(db, user['id']))['balance']})
+
+@api_router.post('/users/me/timezone', response_model=UserProfile)
+async def set_timezone(tz_req: TimezoneRequest, user=Depends(get_current_user)):
+    if not streaks.is_valid_timezone(tz_req.timezone):
+        raise HTTPException(status_code=400, detail='Unknown timezone')
+    await db.users.update_one({'id': user['id']}, {'$set': {'timezone': tz_req.timezone}})
+    return user_profile({**user, 'timezone': tz_req.timezone})
 
 @api_router.get('/courses', response_model=List[Course])
 async def get_courses():
-    courses = await db.courses.find({}, {'_id': 0}).to_list(100)
-    return courses
+    return await catalog.list_courses(100)
+
+@api_router.get('/courses/search')
+async def search_courses(q: str, limit: int = 20):
+    return await catalog.search_courses(q, min(max(limit, 1), 100))
 
 @api_router.get('/courses/{course_id}', response_model=Course)
 async def get_course(course_id: str):
-    course = await db.courses.find_one({'id': course_id}, {'_id': 0})
+    course = await catalog.get_course(course_id)
     if not course:
         raise HTTPException(status_code=404, detail='Course not found')
     return course
 
+@api_router.post('/admin/courses/import')
+async def import_courses(request: Request, batch_size: int = 500, user=Depends(get_admin_user)):
+    importer = course_import.CourseImporter(db.courses, Course, Module, batch_size=min(max(batch_size, 1), 5000))
+    try:
+        report = await importer.run(course_import.iter_lines(request.stream()))
+    finally:
+        catalog.invalidate()
+    return report.as_dict()
+
 @api_router.post('/courses/{course_id}/enroll')
-async def enroll_course(course_id: str, user=Depends(get_current_user)):
-    course = await db.courses.find_one({'id': course_id}, {'_id': 0})
+async def enroll_course(course_id: str, user=Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return await run_idempotent(idempotency_key, 'enroll', user, lambda: _enroll_course(course_id, user), course_id)
+
+async def _enroll_course(course_id: str, user: dict):
+    course = await catalog.get_course(course_id)
     if not course:
         raise HTTPException(status_code=404, detail='Course not found')
     
@@ -195,34 +407,64 @@ async def enroll_course(course_id: str, user=Depends(get_current_user)):
     return EnrollmentResponse(**enrollment)
 
 @api_router.post('/quizzes/submit')
-async def submit_quiz(submission: QuizSubmission, user=Depends(get_current_user)):
-    course = await db.courses.find_one({'id': submission.course_id}, {'_id': 0})
+async def submit_quiz(submission: QuizSubmission, user=Depends(get_current_user),
+                      idempotency_key: Optional[str] = Header(None)):
+    return await run_idempotent(idempotency_key, 'quizzes/submit', user, lambda: _submit_quiz(submission, user), submission)
+
+COINS_PER_MODULE = 20
+QUIZ_BATCH_MAX = int(os.environ.get('QUIZ_BATCH_MAX', '100'))
+
+def find_module(course: Optional[dict], module_id: str) -> dict:
     if not course:
         raise HTTPException(status_code=404, detail='Course not found')
-    
-    module = next((m for m in course['modules'] if m['id'] == submission.module_id), None)
+    module = next((m for m in course['modules'] if m['id'] == module_id), None)
     if not module:
         raise HTTPException(status_code=404, detail='Module not found')
-    
-    correct_count = 0
-    for i, answer in enumerate(submission.answers):
-        if i < len(module['questions']):
-            if answer.get('answer') == module['questions'][i].get('correct_answer'):
-                correct_count += 1
-    
-    score = (correct_count / len(module['questions'])) * 100 if module['questions'] else 0
-    passed = score >= 70
-    
-    quiz_attempt = {
+    return module
+
+def grade_submission(submission: QuizSubmission, module: dict, user: dict) -> dict:
+    answers_correct = grade_answers(module, submission.answers)
+    score = (sum(answers_correct) / len(module['questions'])) * 100 if module['questions'] else 0
+    return {
         'id': str(uuid.uuid4()),
         'user_id': user['id'],
         'module_id': submission.module_id,
         'course_id': submission.course_id,
         'score': score,
-        'passed': passed,
+        'passed': score >= 70,
+        'answers_correct': answers_correct,
         'completed_at': datetime.now(timezone.utc).isoformat()
     }
-    await db.quiz_attempts.insert_one(quiz_attempt)
+
+def complete_module(course: dict, enrollment: dict, module_id: str) -> Tuple[int, int]:
+    # Returns the coins for the module and for completing the course.
+    if module_id in enrollment['completed_modules']:
+        return 0, 0
+    enrollment['completed_modules'].append(module_id)
+    enrollment['progress'] = (len(enrollment['completed_modules']) / len(course['modules'])) * 100
+    enrollment['coins_earned'] += COINS_PER_MODULE
+    bonus_coins = 0
+    if enrollment['progress'] >= 100:
+        bonus_coins = max(course.get('coin_reward', 100) - enrollment['coins_earned'], 0)
+        enrollment['coins_earned'] += bonus_coins
+    return COINS_PER_MODULE, bonus_coins
+
+async def queue_quiz_attempts(attempts: List[dict]):
+    try:
+        await quiz_attempt_writer.put_many(attempts)
+    except WriteBehindFull:
+        raise HTTPException(status_code=503, detail='Quiz submissions are backed up, try again shortly',
+                            headers={'Retry-After': '5'})
+
+async def _submit_quiz(submission: QuizSubmission, user: dict):
+    course = await catalog.get_course(submission.course_id)
+    module = find_module(course, submission.module_id)
+    
+    quiz_attempt = grade_submission(submission, module, user)
+    score, passed = quiz_attempt['score'], quiz_attempt['passed']
+    await queue_quiz_attempts([quiz_attempt])
+    await analytics.record_attempt(db, submission.course_id, submission.module_id, quiz_attempt['answers_correct'], score, passed)
+    streak_count = await streaks.record_activity(db, user)
     
     if passed:
         enrollment = await db.enrollments.find_one({
@@ -230,33 +472,100 @@ async def submit_quiz(submission: QuizSubmission, user=Depends(get_current_user)
             'course_id': submission.course_id
         }, {'_id': 0})
         
-        if enrollment and submission.module_id not in enrollment['completed_modules']:
-            enrollment['completed_modules'].append(submission.module_id)
-            enrollment['progress'] = (len(enrollment['completed_modules']) / len(course['modules'])) * 100
-            
-            coins_for_module = 20
-            enrollment['coins_earned'] += coins_for_module
-            
-            await db.enrollments.update_one(
-                {'id': enrollment['id']},
-                {'$set': enrollment}
-            )
-            
-            await db.users.update_one(
-                {'id': user['id']},
-                {'$inc': {'coins': coins_for_module}}
-            )
-            
-            if enrollment['progress'] >= 100:
-                bonus_coins = course.get('coin_reward', 100) - enrollment['coins_earned']
-                if bonus_coins > 0:
-                    await db.users.update_one(
-                        {'id': user['id']},
-                        {'$inc': {'coins': bonus_coins, 'total_courses_completed': 1}}
-                    )
-                    enrollment['coins_earned'] += bonus_coins
+        if enrollment:
+            module_coins, bonus_coins = complete_module(course, enrollment, submission.module_id)
+            if module_coins:
+                await db.enrollments.update_one(
+                    {'id': enrollment['id']},
+                    {'$set': enrollment}
+                )
+                changes = [(module_coins, 'quiz')]
+                if bonus_coins:
+                    changes.append((bonus_coins, 'course_completed'))
+                await add_coin_entries(user['id'], changes, {'total_courses_completed': 1} if bonus_coins else None)
     
-    return {'score': score, 'passed': passed, 'coins_earned': 20 if passed else 0}
+    return {'score': score, 'passed': passed, 'coins_earned': COINS_PER_MODULE if passed else 0, 'streak_count': streak_count}
+
+@api_router.post('/quizzes/submit/batch')
+async def submit_quiz_batch(batch: QuizBatchSubmission, user=Depends(get_current_user),
+                            idempotency_key: Optional[str] = Header(None)):
+    if len(batch.submissions) > QUIZ_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f'At most {QUIZ_BATCH_MAX} submissions per batch')
+    return await run_idempotent(idempotency_key, 'quizzes/submit/batch', user,
+                                lambda: _submit_quiz_batch(batch, user), batch)
+
+async def _submit_quiz_batch(batch: QuizBatchSubmission, user: dict):
+    # Items apply in order, so later submissions see the progress of earlier ones.
+    results = []
+    graded = []
+    for index, submission in enumerate(batch.submissions):
+        course = await catalog.get_course(submission.course_id)
+        try:
+            module = find_module(course, submission.module_id)
+        except HTTPException as e:
+            results.append({'index': index, 'status': 'error', 'detail': e.detail})
+            continue
+        attempt = grade_submission(submission, module, user)
+        result = {'index': index, 'status': 'ok', 'score': attempt['score'], 'passed': attempt['passed'], 'coins_earned': 0}
+        results.append(result)
+        graded.append((result, course, attempt))
+    if not graded:
+        return {'results': results, 'coins_earned': 0, 'streak_count': streaks.effective_streak(user)}
+
+    passed_course_ids = list({attempt['course_id'] for _, _, attempt in graded if attempt['passed']})
+    enrollments = {}
+    if passed_course_ids:
+        found = await db.enrollments.find(
+            {'user_id': user['id'], 'course_id': {'$in': passed_course_ids}}, {'_id': 0}
+        ).to_list(None)
+        enrollments = {e['course_id']: e for e in found}
+    awards: Dict[str, list] = {}
+    for result, course, attempt in graded:
+        enrollment = enrollments.get(course['id'])
+        if attempt['passed'] and enrollment:
+            module_coins, bonus_coins = complete_module(course, enrollment, attempt['module_id'])
+            if module_coins:
+                awards.setdefault(course['id'], []).append((result, module_coins, bonus_coins))
+
+    attempts = [attempt for _, _, attempt in graded]
+    await queue_quiz_attempts(attempts)
+    await analytics.record_attempts(db, attempts)
+    streak_count = await streaks.record_activity(db, user)
+
+    failed = set()
+    if awards:
+        course_ids = list(awards)
+        try:
+            await db.enrollments.bulk_write(
+                [UpdateOne({'id': enrollments[c]['id']}, {'$set': enrollments[c]}) for c in course_ids],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            failed = {course_ids[error['index']] for error in e.details['writeErrors']}
+    quiz_coins = completion_coins = courses_completed = 0
+    for course_id, items in awards.items():
+        for result, module_coins, bonus_coins in items:
+            if course_id in failed:
+                result.update(status='error', detail='Failed to save progress')
+                continue
+            result['coins_earned'] = module_coins + bonus_coins
+            quiz_coins += module_coins
+            completion_coins += bonus_coins
+            courses_completed += bool(bonus_coins)
+    # One ledger entry per reason, under the same reasons as single submissions, and one user write.
+    changes = [(coins, reason) for coins, reason in ((quiz_coins, 'quiz'), (completion_coins, 'course_completed')) if coins]
+    if changes:
+        await add_coin_entries(user['id'], changes,
+                               {'total_courses_completed': courses_completed} if courses_completed else None)
+
+    return {'results': results, 'coins_earned': quiz_coins + completion_coins, 'streak_count': streak_count}
+
+@api_router.get('/analytics/courses/{course_id}')
+async def get_course_analytics(course_id: str, day: Optional[str] = None, user=Depends(get_current_user)):
+    course = await catalog.get_course(course_id)
+    if not course:
+        raise HTTPException(status_code=404, detail='Course not found')
+    return await analytics.course_stats(db, course, day or analytics.ALL_TIME)
 
 @api_router.get('/enrollments', response_model=List[EnrollmentResponse])
 async def get_enrollments(user=Depends(get_current_user)):
@@ -283,7 +592,11 @@ async def get_mentors(skill: Optional[str] = None):
     return mentors
 
 @api_router.post('/p2p/sessions/book')
-async def book_session(booking: SessionBooking, user=Depends(get_current_user)):
+async def book_session(booking: SessionBooking, user=Depends(get_current_user),
+                       idempotency_key: Optional[str] = Header(None)):
+    return await run_idempotent(idempotency_key, 'p2p/sessions/book', user, lambda: _book_session(booking, user), booking)
+
+async def _book_session(booking: SessionBooking, user: dict):
     if booking.mentor_id == user['id']:
         raise HTTPException(status_code=400, detail='Cannot book session with yourself')
     
@@ -298,7 +611,8 @@ async def book_session(booking: SessionBooking, user=Depends(get_current_user)):
         'feedback': None,
         'created_at': datetime.now(timezone.utc).isoformat()
     }
-    await db.p2p_sessions.insert_one(session)
+    await db.p2p_sessions.insert_one({**session})
+    notify_session('booked', session)
     return session
 
 @api_router.get('/p2p/sessions/my')
@@ -325,10 +639,9 @@ async def rate_session(rating: SessionRating, user=Depends(get_current_user)):
         {'$set': {'rating': rating.rating, 'feedback': rating.feedback, 'status': 'completed'}}
     )
     
-    await db.users.update_one(
-        {'id': session['learner_id']},
-        {'$inc': {'total_sessions_completed': 1, 'coins': 10}}
-    )
+    await add_coins(session['learner_id'], 10, 'session_rated', {'total_sessions_completed': 1})
+    await streaks.record_activity(db, user)
+    notify_session('rated', {**session, 'rating': rating.rating, 'feedback': rating.feedback, 'status': 'completed'})
     
     return {'message': 'Session rated successfully', 'coins_earned': 10}
 
@@ -340,24 +653,59 @@ async def get_leaderboard():
     ).sort('coins', -1).limit(50).to_list(50)
     return users
 
+@api_router.get('/leaderboard/window')
+async def get_window_leaderboard(days: int = 7):
+    end = datetime.now(timezone.utc)
+    totals = await ledger.window_totals(db, end - timedelta(days=min(max(days, 1), 365)), end, 50)
+    names = {u['id']: u['name'] for u in await db.users.find(
+        {'id': {'$in': [t['user_id'] for t in totals]}}, {'_id': 0, 'id': 1, 'name': 1}
+    ).to_list(len(totals))}
+    return [{'id': t['user_id'], 'name': names.get(t['user_id']), 'coins_earned': t['coins_earned']} for t in totals]
+
+@api_router.get('/coins/balance')
+async def get_coin_balance(user=Depends(get_current_user)):
+    return await ledger.balance(db, user['id'])
+
+@api_router.get('/coins/ledger')
+async def get_coin_ledger(start: Optional[datetime] = None, end: Optional[datetime] = None, limit: int = 100,
+                          user=Depends(get_current_user)):
+    def utc(value: Optional[datetime]) -> Optional[datetime]:
+        return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+    return await ledger.entries(db, user['id'], utc(start), utc(end), min(max(limit, 1), 1000))
+
+@api_router.get('/leaderboard/streaks')
+async def get_streak_leaderboard():
+    # Only users active in the last 48h can still hold a live streak in any timezone.
+    now = datetime.now(timezone.utc)
+    candidates = await db.users.find(
+        {'streak_count': {'$gt': 0}, 'last_activity': {'$gte': (now - timedelta(hours=48)).isoformat()}},
+        {'_id': 0, 'id': 1, 'name': 1, 'streak_count': 1, 'longest_streak': 1, 'streak_day': 1, 'timezone': 1}
+    ).sort('streak_count', -1).limit(100).to_list(100)
+    leaders = []
+    for u in candidates:
+        streak = streaks.effective_streak(u, now)
+        if streak:
+            leaders.append({'id': u['id'], 'name': u['name'], 'streak_count': streak,
+                            'longest_streak': u.get('longest_streak', streak)})
+    return leaders[:50]
+
 @api_router.get('/rewards')
 async def get_rewards():
-    rewards = await db.rewards.find({}, {'_id': 0}).to_list(100)
-    return rewards
+    return await catalog.list_rewards(100)
 
 @api_router.post('/rewards/redeem')
-async def redeem_reward(redemption: RewardRedemption, user=Depends(get_current_user)):
-    reward = await db.rewards.find_one({'id': redemption.reward_id}, {'_id': 0})
+async def redeem_reward(redemption: RewardRedemption, user=Depends(get_current_user),
+                        idempotency_key: Optional[str] = Header(None)):
+    return await run_idempotent(idempotency_key, 'rewards/redeem', user, lambda: _redeem_reward(redemption, user), redemption)
+
+async def _redeem_reward(redemption: RewardRedemption, user: dict):
+    reward = await catalog.get_reward(redemption.reward_id)
     if not reward:
         raise HTTPException(status_code=404, detail='Reward not found')
     
-    if user['coins'] < reward['coin_cost']:
+    if not await ledger.debit(db, user['id'], reward['coin_cost'], 'reward_redeemed'):
         raise HTTPException(status_code=400, detail='Insufficient coins')
-    
-    await db.users.update_one(
-        {'id': user['id']},
-        {'$inc': {'coins': -reward['coin_cost']}}
-    )
+    await coins_changed(user['id'], [(-reward['coin_cost'], 'reward_redeemed')])
     
     user_reward = {
         'id': str(uuid.uuid4()),
@@ -370,13 +718,14 @@ async def redeem_reward(redemption: RewardRedemption, user=Depends(get_current_u
     return {'message': 'Reward redeemed successfully'}
 
 @api_router.get('/ai/recommendations')
-async def get_ai_recommendations(user=Depends(get_current_user)):
+async def get_ai_recommendations(user=Depends(limit_by_user('recommendations'))):
     enrollments = await db.enrollments.find({'user_id': user['id']}, {'_id': 0}).to_list(100)
     completed_courses = [e for e in enrollments if e['progress'] >= 100]
     
-    all_courses = await db.courses.find({}, {'_id': 0, 'title': 1}).to_list(100)
+    all_courses = await catalog.list_courses(100)
     completed_titles = [c['course_id'] for c in completed_courses]
     
+    LlmChat, UserMessage = _llm_chat()
     chat = LlmChat(
         api_key=os.environ.get('EMERGENT_LLM_KEY'),
         session_id=f"recommendations_{user['id']}",
@@ -393,22 +742,100 @@ async def get_ai_recommendations(user=Depends(get_current_user)):
     except Exception as e:
         return {'recommendations': 'Keep learning! Explore our course catalog to discover new skills.'}
 
-app.include_router(api_router)
+@api_router.post('/events/token')
+async def event_token(user=Depends(get_current_user)):
+    return {'token': create_event_token(user['id']), 'expires_in': EVENT_TOKEN_TTL}
+
+@api_router.get('/events')
+async def event_stream(request: Request, token: Optional[str] = None):
+    # EventSource cannot send headers, so it passes a token from POST /events/token as a query parameter.
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and credentials:
+        user = await user_from_token(credentials)
+    elif token:
+        user = await user_from_token(token, scope='events')
+    else:
+        raise HTTPException(status_code=401, detail='Not authenticated')
+    sub = broker.subscribe(f"user:{user['id']}", 'leaderboard')
+    return StreamingResponse(
+        events.stream(broker, sub),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@api_router.get('/health')
+async def health():
+    return {'status': 'ok', 'startup': STARTUP_METRICS}
+
+# Records the time from import to the first served request.
+class FirstRequestTimer:
+    def __init__(self, app):
+        self.app = app
+        self.done = False
+
+    async def __call__(self, scope, receive, send):
+        if self.done or scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        self.done = True
+        await self.app(scope, receive, send)
+        STARTUP_METRICS['time_to_first_request_s'] = round(time.perf_counter() - _IMPORT_STARTED, 4)
+        logger.info('First request served %.3fs after import', STARTUP_METRICS['time_to_first_request_s'])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, db, quiz_attempt_writer, idempotency_store, coins_writer
+    started = time.perf_counter()
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], uuidRepresentation='standard', tz_aware=True)
+    db = storage.wrap_database(client[os.environ['DB_NAME']], os.environ.get('STORAGE_FORMAT', storage.STRING))
+    await ensure_indexes()
+    # Balances are read from the ledger, so pre-ledger coins must be in it before serving.
+    await ledger.open_once(db)
+    if os.environ.get('RATE_LIMIT_STORE', 'memory') == 'mongo':
+        rate_limiter.store = MongoBucketStore(db.rate_limits)
+        await rate_limiter.store.ensure_indexes()
+    catalog.db = db
+    await catalog.refresh()
+    idempotency_store = idempotency.IdempotencyStore(
+        db.idempotency_keys,
+        ttl=float(os.environ.get('IDEMPOTENCY_TTL', '86400')),
+        lru_size=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000')),
+    )
+    await idempotency_store.ensure_indexes()
+    spill_dir = os.environ.get('QUIZ_ATTEMPT_SPILL_DIR')
+    quiz_attempt_writer = WriteBehindBuffer(
+        db.quiz_attempts,
+        max_batch=int(os.environ.get('QUIZ_ATTEMPT_BATCH', '500')),
+        flush_interval=float(os.environ.get('QUIZ_ATTEMPT_FLUSH_INTERVAL', '0.25')),
+        max_pending=int(os.environ.get('QUIZ_ATTEMPT_MAX_PENDING', '10000')),
+        put_timeout=float(os.environ.get('QUIZ_ATTEMPT_PUT_TIMEOUT', '5')),
+        spill_dir=Path(spill_dir) if spill_dir else None,
+    )
+    await quiz_attempt_writer.start()
+    coins_writer = ledger.UserCoinsWriter(db, interval=float(os.environ.get('COINS_REFRESH_INTERVAL', '1')))
+    await coins_writer.start()
+    STARTUP_METRICS['startup_s'] = round(time.perf_counter() - started, 4)
+    logger.info('Worker %d ready: import %.3fs, startup %.3fs',
+                os.getpid(), STARTUP_METRICS['import_s'], STARTUP_METRICS['startup_s'])
+    try:
+        yield
+    finally:
+        await quiz_attempt_writer.close()
+        await coins_writer.close()
+        client.close()
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(api_router)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(FirstRequestTimer)
+    return app
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+app = create_app()
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+STARTUP_METRICS['import_s'] = round(time.perf_counter() - _IMPORT_STARTED, 4)
@@ -0,0 +1,352 @@
+"""Optional compact storage encoding for ids and timestamps.
+
+The API (and all of server.py) deals in UUID strings and ISO-8601 strings.
+``STORAGE_FORMAT`` controls how those are stored in the core collections:
+
+* ``string`` (default) - as-is; ``db`` is the plain Motor database.
+* ``dual``    - writes use the compact encoding, reads and filters match
+  both encodings. Run this while ``python storage.py migrate`` converts
+  existing documents.
+* ``compact`` - ids are BSON UUIDs (binary subtype 4, 16 bytes instead of
+  a 36-character string) and timestamps are native BSON dates, which also
+  makes time range queries compare chronologically.
+
+In the non-string modes ``wrap_database`` returns a proxy whose collections
+encode filters, documents and updates on the way in and decode results on
+the way out, so handlers keep reading and writing strings. The client must
+be created with ``uuidRepresentation='standard'`` and ``tz_aware=True``.
+
+``python storage.py report`` prints document, index and working-set sizes;
+``migrate`` prints them before and after converting.
+"""
+import argparse
+import asyncio
+import copy
+import os
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+STRING, DUAL, COMPACT = 'string', 'dual', 'compact'
+
+CODEC_COLLECTIONS = {'users', 'courses', 'enrollments', 'quiz_attempts', 'p2p_sessions', 'rewards', 'user_rewards'}
+ID_FIELDS = {'id', 'user_id', 'course_id', 'module_id', 'mentor_id', 'learner_id', 'reward_id', 'session_id',
+             'completed_modules'}
+TIME_FIELDS = {'created_at', 'enrolled_at', 'completed_at', 'scheduled_at', 'redeemed_at', 'last_activity'}
+RANGE_OPERATORS = {'$lt', '$lte', '$gt', '$gte'}
+LIST_OPERATORS = {'$in', '$nin', '$all'}
+DOC_UPDATE_OPERATORS = {'$set', '$setOnInsert', '$addToSet', '$push', '$pull'}
+
+def _leaf(path: str) -> str:
+    return path.rsplit('.', 1)[-1]
+
+def to_uuid(value: Any) -> Any:
+    if isinstance(value, str) and len(value) == 36:
+        try:
+            parsed = uuid.UUID(value)
+        except ValueError:
+            return value
+        # Only canonical strings, so decoding gives back exactly what was stored.
+        if str(parsed) == value:
+            return parsed
+    return value
+
+def to_datetime(value: Any) -> Any:
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+    return value
+
+def encode_value(field: str, value: Any) -> Any:
+    leaf = _leaf(field)
+    if leaf in ID_FIELDS:
+        return [to_uuid(v) for v in value] if isinstance(value, list) else to_uuid(value)
+    if leaf in TIME_FIELDS:
+        return to_datetime(value)
+    return value
+
+def encode_doc(doc: Any, field: str = '') -> Any:
+    if isinstance(doc, dict):
+        return {k: encode_doc(v, k) if k.startswith('$') else encode_value(k, encode_doc(v, k)) for k, v in doc.items()}
+    if isinstance(doc, list):
+        return [encode_doc(v, field) for v in doc]
+    return doc
+
+def decode(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+    return value
+
+class StorageCodec:
+    def __init__(self, mode: str):
+        if mode not in (DUAL, COMPACT):
+            raise ValueError(f'Unknown storage format: {mode}')
+        self.mode = mode
+
+    def _alternatives(self, field: str, value: Any) -> List[Any]:
+        encoded = encode_value(field, value)
+        if self.mode == DUAL and encoded is not value and encoded != value:
+            return [value, encoded]
+        return [encoded]
+
+    def _encode_condition(self, field: str, condition: Any, alternatives_out: List[dict]) -> Any:
+        if _leaf(field) not in ID_FIELDS | TIME_FIELDS:
+            return condition
+        if isinstance(condition, dict) and any(k.startswith('$') for k in condition):
+            ranges = {op: v for op, v in condition.items() if op in RANGE_OPERATORS}
+            encoded = {}
+            for op, v in condition.items():
+                if op in LIST_OPERATORS:
+                    encoded[op] = [alt for item in v for alt in self._alternatives(field, item)]
+                elif op == '$ne':
+                    encoded['$nin'] = self._alternatives(field, v)
+                elif op == '$eq':
+                    encoded['$in'] = self._alternatives(field, v)
+                elif op in RANGE_OPERATORS:
+                    continue
+                else:
+                    encoded[op] = v
+            if ranges:
+                compact = {op: encode_value(field, v) for op, v in ranges.items()}
+                if self.mode == DUAL and compact != ranges:
+                    # Strings and dates never compare with each other, so match either form.
+                    alternatives_out.append({'$or': [{field: ranges}, {field: compact}]})
+                else:
+                    encoded.update(compact)
+            return encoded
+        if isinstance(condition, (str, list)):
+            options = self._alternatives(field, condition)
+            return {'$in': options} if len(options) > 1 else options[0]
+        return condition
+
+    def encode_filter(self, query: Optional[dict]) -> dict:
+        if not query:
+            return {}
+        alternatives: List[dict] = []
+        encoded = {}
+        for key, value in query.items():
+            if key in ('$or', '$and', '$nor'):
+                encoded[key] = [self.encode_filter(q) for q in value]
+            else:
+                condition = self._encode_condition(key, value, alternatives)
+                if condition != {} or not isinstance(value, dict):
+                    encoded[key] = condition
+        if alternatives:
+            encoded = {'$and': [encoded, *alternatives]} if encoded else {'$and': alternatives}
+        return encoded
+
+    def encode_update(self, update: Any) -> Any:
+        if isinstance(update, list):
+            # Pipeline: only literal values of $set/$addFields stages are encoded.
+            return [
+                {op: {k: encode_value(k, v) if not isinstance(v, dict) else v for k, v in body.items()}
+                 if op in ('$set', '$addFields') else body for op, body in stage.items()}
+                for stage in update
+            ]
+        return {op: encode_doc(body) if op in DOC_UPDATE_OPERATORS else body for op, body in update.items()}
+
+    def encode_pipeline(self, pipeline: List[dict]) -> List[dict]:
+        return [{'$match': self.encode_filter(stage['$match'])} if '$match' in stage else stage for stage in pipeline]
+
+    def encode_operation(self, op):
+        # pymongo's bulk operation classes keep their arguments in private slots.
+        op = copy.copy(op)
+        if getattr(op, '_filter', None) is not None:
+            op._filter = self.encode_filter(op._filter)
+        if getattr(op, '_doc', None) is not None:
+            is_update = isinstance(op._doc, list) or any(k.startswith('$') for k in op._doc)
+            op._doc = self.encode_update(op._doc) if is_update else encode_doc(op._doc)
+        return op
+
+class CodecCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, n):
+        self._cursor.limit(n)
+        return self
+
+    def skip(self, n):
+        self._cursor.skip(n)
+        return self
+
+    def batch_size(self, n):
+        self._cursor.batch_size(n)
+        return self
+
+    async def to_list(self, length):
+        return decode(await self._cursor.to_list(length))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return decode(await self._cursor.__anext__())
+
+class CodecCollection:
+    def __init__(self, collection, codec: StorageCodec):
+        self._collection = collection
+        self.codec = codec
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, filter=None, *args, **kwargs):
+        return CodecCursor(self._collection.find(self.codec.encode_filter(filter), *args, **kwargs))
+
+    async def find_one(self, filter=None, *args, **kwargs):
+        return decode(await self._collection.find_one(self.codec.encode_filter(filter), *args, **kwargs))
+
+    async def count_documents(self, filter, **kwargs):
+        return await self._collection.count_documents(self.codec.encode_filter(filter), **kwargs)
+
+    async def distinct(self, key, filter=None, **kwargs):
+        return decode(await self._collection.distinct(key, self.codec.encode_filter(filter), **kwargs))
+
+    async def insert_one(self, document, **kwargs):
+        return await self._collection.insert_one(encode_doc(document), **kwargs)
+
+    async def insert_many(self, documents, **kwargs):
+        return await self._collection.insert_many([encode_doc(d) for d in documents], **kwargs)
+
+    async def update_one(self, filter, update, **kwargs):
+        return await self._collection.update_one(self.codec.encode_filter(filter), self.codec.encode_update(update), **kwargs)
+
+    async def update_many(self, filter, update, **kwargs):
+        return await self._collection.update_many(self.codec.encode_filter(filter), self.codec.encode_update(update), **kwargs)
+
+    async def find_one_and_update(self, filter, update, **kwargs):
+        return decode(await self._collection.find_one_and_update(
+            self.codec.encode_filter(filter), self.codec.encode_update(update), **kwargs))
+
+    async def delete_one(self, filter, **kwargs):
+        return await self._collection.delete_one(self.codec.encode_filter(filter), **kwargs)
+
+    async def delete_many(self, filter, **kwargs):
+        return await self._collection.delete_many(self.codec.encode_filter(filter), **kwargs)
+
+    async def bulk_write(self, requests, **kwargs):
+        return await self._collection.bulk_write([self.codec.encode_operation(r) for r in requests], **kwargs)
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        return CodecCursor(self._collection.aggregate(self.codec.encode_pipeline(pipeline), *args, **kwargs))
+
+class CodecDatabase:
+    def __init__(self, database, codec: StorageCodec):
+        self._database = database
+        self.codec = codec
+        self._collections: Dict[str, CodecCollection] = {}
+
+    def __getitem__(self, name):
+        if name not in CODEC_COLLECTIONS:
+            return self._database[name]
+        if name not in self._collections:
+            self._collections[name] = CodecCollection(self._database[name], self.codec)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in CODEC_COLLECTIONS:
+            return self[name]
+        return getattr(self._database, name)
+
+def wrap_database(database, mode: str = STRING):
+    if mode == STRING:
+        return database
+    return CodecDatabase(database, StorageCodec(mode))
+
+async def storage_report(db) -> List[dict]:
+    rows = []
+    for name in sorted(CODEC_COLLECTIONS):
+        stats = await db.command('collStats', name)
+        rows.append({
+            'collection': name,
+            'count': stats.get('count', 0),
+            'avg_obj_size': stats.get('avgObjSize', 0),
+            'data_size': stats.get('size', 0),
+            'index_size': stats.get('totalIndexSize', 0),
+            'working_set': stats.get('size', 0) + stats.get('totalIndexSize', 0),
+        })
+    return rows
+
+def print_report(title: str, rows: List[dict]):
+    print(title)
+    print(f'  {"collection":<16}{"docs":>12}{"avg doc":>10}{"data":>14}{"indexes":>14}{"working set":>14}')
+    for r in rows:
+        print(f'  {r["collection"]:<16}{r["count"]:>12,}{r["avg_obj_size"]:>10,}{r["data_size"]:>14,}'
+              f'{r["index_size"]:>14,}{r["working_set"]:>14,}')
+    print(f'  {"total":<16}{"":>22}{sum(r["data_size"] for r in rows):>14,}'
+          f'{sum(r["index_size"] for r in rows):>14,}{sum(r["working_set"] for r in rows):>14,}')
+
+def _changes(doc: dict) -> Dict[str, Any]:
+    encoded = encode_doc(doc)
+    return {k: v for k, v in encoded.items() if k != '_id' and v != doc[k]}
+
+async def migrate_collection(collection, batch_size: int = 1000) -> Dict[str, int]:
+    """Convert every document of ``collection`` in place, in ``_id`` order.
+
+    Each field is only rewritten if it still holds the value that was read,
+    so a concurrent write wins; documents skipped that way are picked up by
+    the next pass.
+    """
+    converted = skipped = 0
+    last_id = None
+    while True:
+        query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+        docs = await collection.find(query).sort('_id', 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        last_id = docs[-1]['_id']
+        ops = []
+        for doc in docs:
+            changes = _changes(doc)
+            if changes:
+                ops.append(UpdateOne({'_id': doc['_id'], **{k: doc[k] for k in changes}}, {'$set': changes}))
+        if ops:
+            result = await collection.bulk_write(ops, ordered=False)
+            converted += result.modified_count
+            skipped += len(ops) - result.matched_count
+    return {'converted': converted, 'skipped': skipped}
+
+async def migrate(db, batch_size: int = 1000, max_passes: int = 5):
+    for name in sorted(CODEC_COLLECTIONS):
+        for attempt in range(max_passes):
+            result = await migrate_collection(db[name], batch_size)
+            print(f'{name}: pass {attempt + 1}: converted {result["converted"]}, skipped {result["skipped"]}')
+            if not result['skipped']:
+                break
+
+async def main(args):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], uuidRepresentation='standard', tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    print_report('Before' if args.command == 'migrate' else 'Storage', await storage_report(db))
+    if args.command == 'migrate':
+        await migrate(db, args.batch_size)
+        print_report('After', await storage_report(db))
+    client.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report on or migrate to the compact storage format.')
+    parser.add_argument('command', choices=['report', 'migrate'])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
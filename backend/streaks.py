@@ -0,0 +1,118 @@
+"""Learning-streak bookkeeping.
+
+A streak counts consecutive local calendar days with at least one activity
+(quiz submission, session rating). Each user document carries:
+
+* ``streak_count``   - current streak length
+* ``longest_streak`` - best streak so far
+* ``streak_day``     - ordinal of the local day of the last activity
+* ``last_activity``  - UTC ISO timestamp of the last activity
+* ``timezone``       - IANA zone used for day boundaries (default UTC)
+
+Activity is recorded with one atomic pipeline update, so nothing is ever
+recomputed from ``quiz_attempts``. Streaks that lapse without new activity
+are zeroed by ``expire_streaks`` (run nightly: ``python streaks.py``) and are
+reported as 0 on read in the meantime.
+"""
+import asyncio
+import os
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+
+import storage
+
+DEFAULT_TIMEZONE = 'UTC'
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+def local_day(now: datetime, tz_name: Optional[str]) -> int:
+    try:
+        tz = ZoneInfo(tz_name or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        tz = ZoneInfo(DEFAULT_TIMEZONE)
+    return now.astimezone(tz).date().toordinal()
+
+def effective_streak(user: dict, now: Optional[datetime] = None) -> int:
+    """The streak as of ``now``, even if the nightly expiry has not run yet."""
+    streak_day = user.get('streak_day')
+    if not user.get('streak_count') or streak_day is None:
+        return 0
+    today = local_day(now or datetime.now(timezone.utc), user.get('timezone'))
+    return user['streak_count'] if streak_day >= today - 1 else 0
+
+def activity_pipeline(today: int, now: datetime) -> list:
+    current = {'$ifNull': ['$streak_count', 0]}
+    return [
+        {'$set': {
+            'streak_count': {'$switch': {
+                'branches': [
+                    # Same day (or a clock/timezone change put us "before" the last one): no change.
+                    {'case': {'$gte': ['$streak_day', today]}, 'then': {'$max': [current, 1]}},
+                    {'case': {'$eq': ['$streak_day', today - 1]}, 'then': {'$add': [current, 1]}},
+                ],
+                'default': 1,
+            }},
+            'streak_day': {'$max': [{'$ifNull': ['$streak_day', today]}, today]},
+            'last_activity': now.isoformat(),
+        }},
+        {'$set': {'longest_streak': {'$max': [{'$ifNull': ['$longest_streak', 0]}, '$streak_count']}}},
+    ]
+
+async def record_activity(db, user: dict, now: Optional[datetime] = None) -> int:
+    """Advance ``user``'s streak for an activity at ``now``; returns the new streak."""
+    now = now or datetime.now(timezone.utc)
+    today = local_day(now, user.get('timezone'))
+    updated = await db.users.find_one_and_update(
+        {'id': user['id']},
+        activity_pipeline(today, now),
+        projection={'_id': 0, 'streak_count': 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    return updated['streak_count'] if updated else 0
+
+async def expire_streaks(db, now: Optional[datetime] = None) -> int:
+    """Zero every streak whose last activity is before the user's local yesterday.
+
+    ``db`` must come from ``storage.wrap_database``: ``last_activity`` is
+    compared as an ISO string, which the codec turns into a date (or into
+    both forms in ``dual`` mode) when that is how it is stored.
+    """
+    now = now or datetime.now(timezone.utc)
+    # Local "yesterday" always starts less than 48h ago and any live streak
+    # had activity within it, so everything newer than 24h is certainly alive.
+    # This bound lets the partial last_activity index do the narrowing.
+    candidates = {
+        'streak_count': {'$gt': 0},
+        'last_activity': {'$lt': (now - timedelta(hours=24)).isoformat()},
+    }
+    expired = 0
+    # ``None`` also matches users that predate the timezone field.
+    for tz_name in set(await db.users.distinct('timezone', candidates)) | {None}:
+        result = await db.users.update_many(
+            {**candidates, 'timezone': tz_name, 'streak_day': {'$lt': local_day(now, tz_name) - 1}},
+            {'$set': {'streak_count': 0}},
+        )
+        expired += result.modified_count
+    return expired
+
+async def main():
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], uuidRepresentation='standard', tz_aware=True)
+    db = storage.wrap_database(client[os.environ['DB_NAME']], os.environ.get('STORAGE_FORMAT', storage.STRING))
+    expired = await expire_streaks(db)
+    client.close()
+    print(f'Expired {expired} streaks')
+
+if __name__ == '__main__':
+    asyncio.run(main())
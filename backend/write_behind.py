@@ -0,0 +1,245 @@
+"""Write-behind batching for append-only collections.
+
+``WriteBehindBuffer.put`` queues a document and returns immediately; a
+background task drains the queue into ``insert_many(ordered=False)`` calls
+of up to ``max_batch`` documents, or whatever has arrived after
+``flush_interval`` seconds. When ``max_pending`` documents are waiting,
+``put`` blocks until the flusher catches up, so a slow database pushes back
+on callers instead of growing memory without bound; after ``put_timeout``
+seconds it gives up with ``WriteBehindFull``.
+
+Connection errors and timeouts are retried until they clear. Documents the
+database rejects for any other reason are not retried: they are logged and
+appended to ``<collection>.dead.ndjson`` in ``spill_dir``, if there is one.
+
+With a ``spill_dir``, every queued document is first appended to a local
+NDJSON segment. Segments are deleted once all of their documents are
+committed, and segments left behind by a dead process are replayed on
+start. A replaying worker claims a segment by renaming it, so two workers
+starting together do not replay the same one. Replays rely on a unique
+index on ``id`` so already-committed documents are skipped.
+"""
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from pymongo.errors import AutoReconnect, BulkWriteError, NetworkTimeout
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+TRANSIENT_ERRORS = (AutoReconnect, NetworkTimeout)
+
+class WriteBehindFull(Exception):
+    pass
+
+class WriteBehindBuffer:
+    def __init__(self, collection, max_batch: int = 500, flush_interval: float = 0.25,
+                 max_pending: int = 10_000, put_timeout: float = 5.0,
+                 spill_dir: Optional[Path] = None, segment_records: int = 5_000):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.segment_records = segment_records
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # One slot per queued document, returned once its batch is written.
+        self._slots = asyncio.Semaphore(max_pending)
+        self._task: Optional[asyncio.Task] = None
+        self._batch_ready = asyncio.Event()
+        self._seq = 0
+        self._segment = None
+        self._segment_path: Optional[Path] = None
+        self._segment_count = 0
+        # (path, last seq) of closed segments still holding uncommitted documents.
+        self._sealed: List[Tuple[Path, int]] = []
+        self.inserted = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self.spill_dir:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            await self._replay_orphans()
+            self._open_segment()
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, doc: dict):
+        await self.put_many([doc])
+
+    async def put_many(self, docs: List[dict]):
+        """Queue all of ``docs`` or, if there is no room within ``put_timeout``, none of them."""
+        acquired = 0
+        try:
+            async with asyncio.timeout(self.put_timeout):
+                for _ in docs:
+                    await self._slots.acquire()
+                    acquired += 1
+        except TimeoutError:
+            for _ in range(acquired):
+                self._slots.release()
+            raise WriteBehindFull(f'{self.pending()} {self.collection.name} documents waiting to be written') from None
+        for doc in docs:
+            self._seq += 1
+            if self._segment:
+                self._segment.write(json.dumps(doc, separators=(',', ':')) + '\n')
+                self._segment.flush()
+                self._segment_count += 1
+                if self._segment_count >= self.segment_records:
+                    self._seal_segment()
+            self._queue.put_nowait((self._seq, doc))
+        if self._queue.qsize() >= self.max_batch:
+            self._batch_ready.set()
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def close(self, timeout: float = 10.0):
+        """Flush everything queued; on timeout the spill segments are kept for replay."""
+        flushed = True
+        if self._task:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                flushed = False
+                logger.warning('%d %s documents not flushed on shutdown', self.pending(), self.collection.name)
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._segment:
+            self._seal_segment(reopen=False)
+            if flushed:
+                self._release(self._seq)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.max_batch - 1:
+                # One timed wait per batch rather than per document.
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._insert_with_retry([doc for _, doc in batch])
+            except Exception:
+                # The flusher must outlive any one batch, or the queue stops draining for good.
+                logger.exception('Write-behind flush of %d %s documents failed; dropped',
+                                 len(batch), self.collection.name)
+            self._release(batch[-1][0])
+            for _ in batch:
+                self._queue.task_done()
+                self._slots.release()
+
+    async def _insert_with_retry(self, docs: List[dict]):
+        delay = 0.1
+        while True:
+            try:
+                rejected = await self._insert(docs)
+                break
+            except TRANSIENT_ERRORS:
+                # Keep the batch: the queue filling up is what pushes back on callers.
+                logger.exception('Write-behind flush of %d documents failed; retrying in %.1fs', len(docs), delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+            except Exception:
+                logger.exception('Write-behind flush of %d documents failed permanently', len(docs))
+                rejected = docs
+                break
+        self.inserted += len(docs) - len(rejected)
+        if rejected:
+            self._dead_letter(rejected)
+
+    async def _insert(self, docs: List[dict]) -> List[dict]:
+        """Insert ``docs``; returns the ones rejected for a reason other than already being stored."""
+        try:
+            # Copies: pymongo adds an ObjectId ``_id`` to the documents it is given.
+            await self.collection.insert_many([dict(doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != DUPLICATE_KEY]
+            if errors:
+                logger.error('Write-behind insert into %s rejected %d documents, first: %s',
+                             self.collection.name, len(errors), errors[0].get('errmsg'))
+            return [docs[err['index']] for err in errors]
+        return []
+
+    def _dead_letter(self, docs: List[dict]):
+        self.rejected += len(docs)
+        lines = ''.join(json.dumps(doc, separators=(',', ':'), default=str) + '\n' for doc in docs)
+        if self.spill_dir:
+            with open(self.spill_dir / f'{self.collection.name}.dead.ndjson', 'a') as f:
+                f.write(lines)
+            logger.error('Wrote %d rejected %s documents to %s.dead.ndjson',
+                         len(docs), self.collection.name, self.collection.name)
+        else:
+            logger.error('Dropped %d rejected %s documents:\n%s', len(docs), self.collection.name, lines)
+
+    def _open_segment(self):
+        self._segment_path = self.spill_dir / f'{self.collection.name}.{os.getpid()}.{self._seq}.ndjson'
+        self._segment = open(self._segment_path, 'a')
+        self._segment_count = 0
+
+    def _seal_segment(self, reopen: bool = True):
+        self._segment.close()
+        self._segment = None
+        self._sealed.append((self._segment_path, self._seq))
+        if reopen:
+            self._open_segment()
+
+    def _release(self, committed_seq: int):
+        while self._sealed and self._sealed[0][1] <= committed_seq:
+            path, _ = self._sealed.pop(0)
+            path.unlink(missing_ok=True)
+
+    async def _replay_orphans(self):
+        prefix = f'{self.collection.name}.'
+        for path in sorted(self.spill_dir.glob(f'{prefix}*')):
+            # <collection>.<pid>.<seq>.ndjson, or that name plus .replaying.<pid> once claimed.
+            parts = path.name[len(prefix):].split('.')
+            if len(parts) not in (3, 5) or parts[2] != 'ndjson' or not parts[0].isdigit():
+                continue
+            owner = int(parts[-1] if len(parts) == 5 else parts[0])
+            if owner != os.getpid() and _process_alive(owner):
+                continue
+            claimed = path.with_name(f'{prefix}{parts[0]}.{parts[1]}.ndjson.replaying.{os.getpid()}')
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # Another worker claimed it first.
+                continue
+            replayed, docs = 0, []
+            with open(claimed) as f:
+                for number, line in enumerate(f, 1):
+                    try:
+                        if line.strip():
+                            docs.append(json.loads(line))
+                    except ValueError:
+                        # A write cut short when the process died.
+                        logger.warning('Skipping unreadable line %d of %s', number, path.name)
+                    if len(docs) >= self.max_batch:
+                        await self._insert_with_retry(docs)
+                        replayed, docs = replayed + len(docs), []
+            if docs:
+                await self._insert_with_retry(docs)
+                replayed += len(docs)
+            logger.info('Replayed %d spilled %s documents from %s', replayed, self.collection.name, path.name)
+            claimed.unlink(missing_ok=True)
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,72 @@
+import { useEffect, useRef } from 'react';
+import api, { API_BASE } from '@/utils/api';
+
+const EVENT_TYPES = ['coins', 'session', 'leaderboard', 'resync'];
+const RECONNECT_DELAY_MS = 3000;
+
+// Subscribes to the server-sent event stream for the logged-in user.
+// `handlers` maps event types to callbacks receiving the parsed payload.
+// `resync` means events were dropped and the page should re-fetch; it is
+// also sent after a reconnect, since events may have been missed meanwhile.
+//
+// EventSource cannot send an Authorization header, so each connection uses
+// a short-lived stream token from POST /events/token instead of the session
+// token. Stream tokens expire quickly, so reconnects fetch a new one rather
+// than relying on EventSource's built-in retry.
+export const useEventStream = (handlers) => {
+  const handlersRef = useRef(handlers);
+  handlersRef.current = handlers;
+
+  useEffect(() => {
+    if (!localStorage.getItem('token') || typeof EventSource === 'undefined') return undefined;
+
+    let source = null;
+    let retryTimer = null;
+    let closed = false;
+    let connected = false;
+
+    const dispatch = (type, payload) => {
+      const handler = handlersRef.current[type];
+      if (handler) handler(payload);
+    };
+
+    const scheduleReconnect = () => {
+      if (!closed) retryTimer = setTimeout(connect, RECONNECT_DELAY_MS);
+    };
+
+    const connect = async () => {
+      let response;
+      try {
+        response = await api.post('/events/token');
+      } catch (error) {
+        scheduleReconnect();
+        return;
+      }
+      if (closed) return;
+
+      source = new EventSource(`${API_BASE}/events?token=${encodeURIComponent(response.data.token)}`);
+      EVENT_TYPES.forEach((type) => {
+        source.addEventListener(type, (e) => dispatch(type, JSON.parse(e.data)));
+      });
+      source.onopen = () => {
+        if (connected) dispatch('resync', { type: 'resync' });
+        connected = true;
+      };
+      source.onerror = () => {
+        source.close();
+        source = null;
+        scheduleReconnect();
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    };
+  }, []);
+};
+
+export default useEventStream;
@@ -4,18 +4,41 @@ import { useNavigate } from 'react-router-dom';
 import api from '@/utils/api';
 import { toast } from 'sonner';
 import Navbar from '@/components/Navbar';
-import { BookOpen, Clock } from 'lucide-react';
+import { Input } from '@/components/ui/input';
+import { BookOpen, Clock, Search } from 'lucide-react';
 
 const Courses = () => {
   const [user, setUser] = useState(null);
   const [courses, setCourses] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [query, setQuery] = useState('');
+  const [results, setResults] = useState(null);
   const navigate = useNavigate();
 
   useEffect(() => {
     fetchData();
   }, []);
 
+  useEffect(() => {
+    if (!query.trim()) {
+      setResults(null);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await api.get('/courses/search', { params: { q: query } });
+        if (!cancelled) setResults(response.data);
+      } catch (error) {
+        if (!cancelled) toast.error('Search failed');
+      }
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [query]);
+
   const fetchData = async () => {
     try {
       const [userRes, coursesRes] = await Promise.all([
@@ -45,10 +68,24 @@ const Courses = () => {
         >
           <h1 className="text-4xl md:text-5xl font-bold text-slate-900 mb-2">Course Catalog</h1>
           <p className="text-lg text-slate-600">Discover courses and start earning coins</p>
+          <div className="relative mt-6 max-w-xl">
+            <Search className="absolute left-4 top-1/2 -translate-y-1/2 w-5 h-5 text-slate-400" />
+            <Input
+              value={query}
+              onChange={(e) => setQuery(e.target.value)}
+              className="pl-12 bg-white/50 border-slate-200 focus:border-violet-500 focus:ring-violet-500/20 rounded-xl h-12"
+              placeholder="Search courses"
+              data-testid="course-search-input"
+            />
+          </div>
         </motion.div>
 
+        {results && results.length === 0 && (
+          <p className="text-slate-600" data-testid="course-search-empty">No courses match "{query}"</p>
+        )}
+
         <div className="grid grid-cols-1 md:grid-cols-3 gap-6">
-          {courses.map((course, index) => (
+          {(results || courses).map((course, index) => (
             <motion.div
               key={course.id}
               initial={{ opacity: 0, y: 20 }}
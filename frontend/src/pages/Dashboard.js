@@ -4,6 +4,7 @@ import { useNavigate } from 'react-router-dom';
 import api from '@/utils/api';
 import { toast } from 'sonner';
 import Navbar from '@/components/Navbar';
+import { useEventStream } from '@/hooks/use-event-stream';
 import { Coins, Flame, TrendingUp, BookOpen, Award } from 'lucide-react';
 
 const Dashboard = () => {
@@ -31,6 +32,24 @@ const Dashboard = () => {
     }
   };
 
+  const refreshProgress = async () => {
+    try {
+      const [userRes, enrollRes] = await Promise.all([
+        api.get('/users/me'),
+        api.get('/enrollments')
+      ]);
+      setUser(userRes.data);
+      setEnrollments(enrollRes.data);
+    } catch (error) {
+      // Keep showing the last known state; the next event will retry.
+    }
+  };
+
+  useEventStream({
+    coins: (event) => setUser((current) => current && { ...current, coins: event.coins }),
+    resync: refreshProgress
+  });
+
   if (!user) return <div className="min-h-screen ambient-bg flex items-center justify-center"><div className="text-2xl text-slate-600">Loading...</div></div>;
 
   return (
@@ -3,6 +3,7 @@ import { motion } from 'framer-motion';
 import api from '@/utils/api';
 import { toast } from 'sonner';
 import Navbar from '@/components/Navbar';
+import { useEventStream } from '@/hooks/use-event-stream';
 import { Trophy, Coins, Medal } from 'lucide-react';
 
 const Leaderboard = () => {
@@ -29,6 +30,21 @@ const Leaderboard = () => {
     }
   };
 
+  const refreshLeaderboard = async () => {
+    try {
+      const leaderRes = await api.get('/leaderboard');
+      setLeaderboard(leaderRes.data);
+    } catch (error) {
+      // Keep the current standings; the next event will retry.
+    }
+  };
+
+  useEventStream({
+    coins: (event) => setUser((current) => current && { ...current, coins: event.coins }),
+    leaderboard: refreshLeaderboard,
+    resync: fetchData
+  });
+
   if (loading) return <div className="min-h-screen ambient-bg flex items-center justify-center"><div className="text-2xl text-slate-600">Loading...</div></div>;
 
   return (
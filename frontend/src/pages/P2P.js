@@ -3,6 +3,7 @@ import { motion } from 'framer-motion';
 import api from '@/utils/api';
 import { toast } from 'sonner';
 import Navbar from '@/components/Navbar';
+import { useEventStream } from '@/hooks/use-event-stream';
 import { Users, Plus, Calendar, Star } from 'lucide-react';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from '@/components/ui/dialog';
 import { Input } from '@/components/ui/input';
@@ -39,6 +40,16 @@ const P2P = () => {
     }
   };
 
+  useEventStream({
+    coins: (event) => setUser((current) => current && { ...current, coins: event.coins }),
+    session: (event) => setSessions((current) => (
+      current.some((session) => session.id === event.session.id)
+        ? current.map((session) => (session.id === event.session.id ? event.session : session))
+        : [...current, event.session]
+    )),
+    resync: fetchData
+  });
+
   const handleAddSkill = async () => {
     if (!newSkill.trim()) return;
     try {
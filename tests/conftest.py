@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other flat, as they do when run from backend/.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+COURSES = [
+    {'id': 'c1', 'title': 'Python for Beginners', 'description': 'Learn Python', 'thumbnail': 't',
+     'coin_reward': 100, 'created_at': '2026-01-01T00:00:00+00:00', 'modules': [
+         {'id': 'm1', 'title': 'Intro', 'video_url': 'v', 'questions': [
+             {'question': 'q1', 'options': ['a', 'b'], 'correct_answer': 'a'},
+             {'question': 'q2', 'options': ['a', 'b'], 'correct_answer': 'b'}]},
+         {'id': 'm2', 'title': 'Variables', 'video_url': 'v', 'questions': [
+             {'question': 'q1', 'options': ['a', 'b'], 'correct_answer': 'a'}]}]},
+    {'id': 'c2', 'title': 'Go Basics', 'description': 'Learn Go', 'thumbnail': 't',
+     'coin_reward': 100, 'created_at': '2026-01-01T00:00:00+00:00', 'modules': [
+         {'id': 'n1', 'title': 'Intro', 'video_url': 'v', 'questions': [
+             {'question': 'q1', 'options': ['a', 'b'], 'correct_answer': 'a'}]},
+         {'id': 'n2', 'title': 'Types', 'video_url': 'v', 'questions': [
+             {'question': 'q1', 'options': ['a', 'b'], 'correct_answer': 'a'}]}]},
+]
+
+@pytest.fixture
+def api(monkeypatch):
+    """A TestClient on a fresh mongomock database holding ``COURSES``."""
+    from fastapi.testclient import TestClient
+    from mongomock_motor import AsyncMongoMockClient
+
+    import server
+    from rate_limit import MemoryBucketStore
+
+    monkeypatch.setenv('MONGO_URL', 'mongodb://localhost')
+    monkeypatch.setenv('DB_NAME', 'test')
+    monkeypatch.setattr(server, 'AsyncIOMotorClient', lambda url, **kwargs: AsyncMongoMockClient(tz_aware=True))
+    monkeypatch.setattr(server.rate_limiter, 'store', MemoryBucketStore())
+    with TestClient(server.create_app()) as client:
+        client.portal.call(server.db.courses.insert_many, [dict(c) for c in COURSES])
+        client.portal.call(server.catalog.refresh)
+        yield client
+
+def signup(client, email='learner@example.com') -> dict:
+    """Signs up a user; returns auth headers for them."""
+    response = client.post('/api/auth/signup', json={'email': email, 'password': 'pw', 'name': 'Learner'})
+    assert response.status_code == 200, response.text
+    return {'Authorization': f"Bearer {response.json()['token']}"}
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+import analytics
+
+DAY1 = datetime(2026, 3, 1, 10, tzinfo=timezone.utc)
+DAY2 = datetime(2026, 3, 2, 23, 59, tzinfo=timezone.utc)
+COURSE = {'id': 'c1', 'modules': [
+    {'id': 'm1', 'title': 'Intro', 'questions': [{'question': 'q0'}, {'question': 'q1'}]},
+    {'id': 'm2', 'title': 'Untried', 'questions': [{'question': 'q0'}]},
+]}
+
+def attempt(answers_correct, when, module_id='m1'):
+    score = sum(answers_correct) / len(answers_correct) * 100
+    return {'course_id': 'c1', 'module_id': module_id, 'answers_correct': answers_correct, 'score': score,
+            'passed': score >= 70, 'completed_at': when.isoformat()}
+
+ATTEMPTS = [
+    attempt([True, True], DAY1),
+    attempt([True, False], DAY1),
+    attempt([False, True], DAY2),
+]
+
+def counters(db):
+    async def read():
+        return {doc['_id']: doc async for doc in db.quiz_stats.find()}
+    return read()
+
+def test_counters_per_day_and_all_time():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        await analytics.record_attempts(db, ATTEMPTS[:2], now=DAY1)
+        a = ATTEMPTS[2]
+        await analytics.record_attempt(db, 'c1', 'm1', a['answers_correct'], a['score'], a['passed'], now=DAY2)
+        return await counters(db)
+
+    stats = asyncio.run(scenario())
+    assert set(stats) == {
+        'm|c1|m1|2026-03-01', 'm|c1|m1|2026-03-02', 'm|c1|m1|all',
+        'q|c1|m1|0|2026-03-01', 'q|c1|m1|1|2026-03-01', 'q|c1|m1|0|2026-03-02', 'q|c1|m1|1|2026-03-02',
+        'q|c1|m1|0|all', 'q|c1|m1|1|all',
+    }
+    pick = lambda doc, *fields: tuple(doc[f] for f in fields)
+    assert pick(stats['m|c1|m1|2026-03-01'], 'attempts', 'passed', 'score_sum') == (2, 1, 150)
+    assert pick(stats['m|c1|m1|2026-03-02'], 'attempts', 'passed', 'score_sum') == (1, 0, 50)
+    assert pick(stats['m|c1|m1|all'], 'attempts', 'passed', 'score_sum', 'kind', 'day') == (3, 1, 200, 'module', 'all')
+    assert pick(stats['q|c1|m1|1|2026-03-01'], 'attempts', 'correct') == (2, 1)
+    assert pick(stats['q|c1|m1|1|all'], 'attempts', 'correct', 'index', 'kind') == (3, 2, 1, 'question')
+
+def test_course_stats_rates():
+    async def scenario():
+        db = AsyncMongoMockClient()['test']
+        await analytics.record_attempts(db, ATTEMPTS[:2], now=DAY1)
+        await analytics.record_attempts(db, ATTEMPTS[2:], now=DAY2)
+        return (await analytics.course_stats(db, COURSE),
+                await analytics.course_stats(db, COURSE, day='2026-03-02'))
+
+    all_time, day2 = asyncio.run(scenario())
+    m1, m2 = all_time['modules']
+    assert (m1['attempts'], m1['passed'], m1['pass_rate'], m1['average_score']) == (3, 1, 33.33, 66.67)
+    assert [(q['attempts'], q['correct'], q['correct_rate']) for q in m1['questions']] == [(3, 2, 66.67), (3, 2, 66.67)]
+    assert (m2['attempts'], m2['pass_rate'], m2['average_score']) == (0, 0.0, 0.0)
+    assert m2['questions'] == [{'index': 0, 'question': 'q0', 'attempts': 0, 'correct': 0, 'correct_rate': 0.0}]
+    assert day2['day'] == '2026-03-02'
+    assert [(q['correct'], q['correct_rate']) for q in day2['modules'][0]['questions']] == [(0, 0.0), (1, 100.0)]
+
+def test_backfill_rebuilds_the_live_counters(monkeypatch):
+    # mongomock has no $type or $substrBytes expressions; every attempt here stores an ISO string,
+    # which is the branch of ATTEMPT_DAY this stands in for.
+    monkeypatch.setattr(analytics, 'ATTEMPT_DAY', {'$substr': ['$completed_at', 0, 10]})
+    legacy = attempt([True, True], DAY2, module_id='m2')
+    del legacy['answers_correct']
+
+    async def scenario():
+        live = AsyncMongoMockClient()['live']
+        await analytics.record_attempts(live, ATTEMPTS[:2], now=DAY1)
+        await analytics.record_attempts(live, ATTEMPTS[2:], now=DAY2)
+        # Stored without answers_correct, so only its module counters can be rebuilt.
+        await analytics.record_attempt(live, 'c1', 'm2', [], legacy['score'], legacy['passed'], now=DAY2)
+
+        db = AsyncMongoMockClient()['rebuilt']
+        await db.quiz_attempts.insert_many([dict(a) for a in ATTEMPTS + [legacy]])
+        await db.quiz_stats.insert_one({'_id': 'm|gone|gone|all', 'attempts': 99})
+        written = await analytics.backfill(db, batch_size=4)
+        return await counters(live), await counters(db), written, await db.list_collection_names()
+
+    live, rebuilt, written, collections = asyncio.run(scenario())
+    assert rebuilt == live
+    assert written == len(live)
+    assert 'q|c1|m2|0|all' not in rebuilt
+    assert 'quiz_stats_rebuild' not in collections
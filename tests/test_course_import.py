@@ -0,0 +1,139 @@
+import asyncio
+import json
+from typing import Dict, List
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pydantic import BaseModel, ConfigDict
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import course_import
+from course_import import CourseImporter, ImportReport, iter_lines
+
+class Module(BaseModel):
+    id: str
+    title: str
+    questions: List[Dict] = []
+
+class Course(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+    id: str
+    title: str
+    modules: List[Module]
+    coin_reward: int = 100
+    created_at: str
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+def collect(lines):
+    async def scenario():
+        return [line async for line in lines]
+    return asyncio.run(scenario())
+
+def test_iter_lines_joins_lines_split_across_chunks():
+    lines = collect(iter_lines(chunks(b'{"a":', b'1}\n{"b"', b':2}\n\n', b'{"c":3}')))
+    assert lines == [b'{"a":1}', b'{"b":2}', b'', b'{"c":3}']
+
+def test_iter_lines_handles_many_lines_per_chunk_and_trailing_newline():
+    assert collect(iter_lines(chunks(b'1\n2\n3\n', b'', b'4\n'))) == [b'1', b'2', b'3', b'4']
+
+def test_iter_lines_rejects_oversized_lines(monkeypatch):
+    monkeypatch.setattr(course_import, 'MAX_LINE_BYTES', 8)
+    lines = []
+
+    async def scenario():
+        async for line in iter_lines(chunks(b'short\n', b'x' * 5, b'x' * 5)):
+            lines.append(line)
+
+    with pytest.raises(ValueError, match='longer than 8 bytes'):
+        asyncio.run(scenario())
+    assert lines == [b'short']
+
+def test_new_course_fields_only_default_on_insert():
+    importer = CourseImporter(None, Course, Module)
+    kind, [op] = importer.operations({'id': 'c1', 'title': 'Python'})
+    assert kind == 'course'
+    assert op._doc['$set'] == {'id': 'c1', 'title': 'Python'}
+    assert set(op._doc['$setOnInsert']) == {'modules', 'coin_reward', 'created_at'}
+    assert op._doc['$setOnInsert']['modules'] == []
+
+    _, [op] = importer.operations({'id': 'c1', 'title': 'Python', 'modules': [],
+                                   'created_at': '2026-01-01T00:00:00+00:00'})
+    assert op._doc['$set']['created_at'] == '2026-01-01T00:00:00+00:00'
+    assert op._doc['$set']['modules'] == []
+    assert set(op._doc['$setOnInsert']) == {'coin_reward'}
+
+class Result:
+    def __init__(self, matched, upserted):
+        self.matched_count = matched
+        self.upserted_count = upserted
+
+class FailingCollection:
+    """Fails the ops whose filter names a course in ``bad``, like an ordered bulk write would."""
+
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.calls: List[List[UpdateOne]] = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.calls.append(list(ops))
+        for index, op in enumerate(ops):
+            if op._filter['id'] in self.bad:
+                raise BulkWriteError({
+                    'writeErrors': [{'index': index, 'code': 121, 'errmsg': f"{op._filter['id']} rejected"}],
+                    'nMatched': index, 'nUpserted': 0,
+                })
+        return Result(len(ops), 0)
+
+def test_flush_reports_the_failing_line_and_continues_after_it():
+    collection = FailingCollection(bad={'c2'})
+    importer = CourseImporter(collection, Course, Module)
+    # Lines 1-4: a course op, a module pair for c2, a module pair for c1, a course op.
+    ops = [UpdateOne({'id': 'c1'}, {}), UpdateOne({'id': 'c2'}, {}), UpdateOne({'id': 'c2'}, {}),
+           UpdateOne({'id': 'c1'}, {}), UpdateOne({'id': 'c1'}, {}), UpdateOne({'id': 'c3'}, {})]
+    report = ImportReport()
+    asyncio.run(importer._flush(ops, [1, 2, 2, 3, 3, 4], report))
+    assert report.errors == [{'line': 2, 'error': 'c2 rejected'}]
+    # The rest of the failing line is skipped; the batch resumes at line 3.
+    assert len(collection.calls) == 2
+    assert [op._filter['id'] for op in collection.calls[1]] == ['c1', 'c1', 'c3']
+
+def test_run_attributes_errors_to_input_lines():
+    collection = FailingCollection(bad={'c2'})
+    importer = CourseImporter(collection, Course, Module, batch_size=2)
+    lines = [
+        json.dumps({'id': 'c1', 'title': 'One'}),
+        '',
+        json.dumps({'id': 'c2', 'title': 'Two'}),
+        '[1, 2]',
+        json.dumps({'id': 'c3'}),
+        json.dumps({'course_id': 'c1', 'id': 'm1', 'title': 'Intro'}),
+    ]
+
+    async def scenario():
+        return await importer.run(chunks(*(line.encode() for line in lines)))
+
+    report = asyncio.run(scenario())
+    assert report.lines == 6
+    assert (report.courses, report.modules) == (2, 1)
+    assert [e['line'] for e in report.errors] == [3, 4, 5]
+    assert report.errors[0]['error'] == 'c2 rejected'
+    assert report.errors[1]['error'] == 'record: must be a JSON object'
+    assert report.errors[2]['error'].startswith('title:')
+
+def test_reimport_keeps_created_at():
+    async def scenario():
+        courses = AsyncMongoMockClient()['test'].courses
+        importer = CourseImporter(courses, Course, Module)
+        await importer.run(chunks(json.dumps({'id': 'c1', 'title': 'One', 'coin_reward': 50}).encode()))
+        first = await courses.find_one({'id': 'c1'})
+        await importer.run(chunks(json.dumps({'id': 'c1', 'title': 'One, revised'}).encode()))
+        return first, await courses.find_one({'id': 'c1'})
+
+    first, second = asyncio.run(scenario())
+    assert second['title'] == 'One, revised'
+    assert second['created_at'] == first['created_at']
+    assert second['coin_reward'] == 50
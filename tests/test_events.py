@@ -0,0 +1,82 @@
+import asyncio
+
+import events
+from events import RESYNC, EventBroker
+
+def test_publish_reaches_topic_subscribers():
+    async def scenario():
+        broker = EventBroker()
+        alice = broker.subscribe('user:alice', 'leaderboard')
+        bob = broker.subscribe('user:bob', 'leaderboard')
+        assert broker.publish('user:alice', {'type': 'coins', 'coins': 5}) == 1
+        assert broker.publish('leaderboard', {'type': 'leaderboard'}) == 2
+        assert broker.publish('user:carol', {'type': 'coins'}) == 0
+        return [await alice.get(0.1), await alice.get(0.1), await bob.get(0.1), await bob.get(0.01)]
+
+    assert asyncio.run(scenario()) == [
+        {'type': 'coins', 'coins': 5}, {'type': 'leaderboard'}, {'type': 'leaderboard'}, None,
+    ]
+
+def test_overflow_replaces_backlog_with_resync():
+    async def scenario():
+        broker = EventBroker(queue_size=3)
+        sub = broker.subscribe('user:alice')
+        for i in range(4):
+            broker.publish('user:alice', {'type': 'coins', 'coins': i})
+        received = [await sub.get(0.01) for _ in range(2)]
+        broker.publish('user:alice', {'type': 'coins', 'coins': 9})
+        return sub, received, await sub.get(0.01)
+
+    sub, received, after = asyncio.run(scenario())
+    assert received == [RESYNC, None]
+    assert sub.dropped == 3
+    # Once drained, the subscriber gets events normally again.
+    assert after == {'type': 'coins', 'coins': 9}
+
+def test_stream_unsubscribes_when_client_disconnects():
+    async def scenario():
+        broker = EventBroker()
+        sub = broker.subscribe('user:alice', 'leaderboard')
+        frames = events.stream(broker, sub, heartbeat=0.01)
+        assert await frames.__anext__() == 'retry: 3000\n\n'
+        broker.publish('leaderboard', {'type': 'leaderboard'})
+        assert await frames.__anext__() == 'event: leaderboard\ndata: {"type":"leaderboard"}\n\n'
+        assert await frames.__anext__() == ': keep-alive\n\n'
+        assert broker.connections == 1
+        # What the server does with the response body when the client goes away.
+        await frames.aclose()
+        return broker
+
+    broker = asyncio.run(scenario())
+    assert broker.connections == 0
+    assert not broker.has_subscribers('user:alice')
+    assert not broker.has_subscribers('leaderboard')
+
+def test_stream_unsubscribes_when_cancelled():
+    async def scenario():
+        broker = EventBroker()
+        sub = broker.subscribe('user:alice')
+
+        async def consume():
+            async for _ in events.stream(broker, sub, heartbeat=10):
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        assert broker.connections == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return broker
+
+    assert asyncio.run(scenario()).connections == 0
+
+def test_publish_coalesced_fires_once():
+    async def scenario():
+        broker = EventBroker()
+        sub = broker.subscribe('leaderboard')
+        for _ in range(5):
+            broker.publish_coalesced('leaderboard', {'type': 'leaderboard'}, delay=0.01)
+        await asyncio.sleep(0.05)
+        return [await sub.get(0.01), await sub.get(0.01)]
+
+    assert asyncio.run(scenario()) == [{'type': 'leaderboard'}, None]
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+from idempotency import IdempotencyStore, fingerprint
+
+FP = fingerprint({'module_id': 'm1'})
+
+class Handler:
+    def __init__(self, result=None, error=None, delay=0.0):
+        self.result = result if result is not None else {'ok': True}
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def new_collection():
+    return AsyncMongoMockClient(tz_aware=True)['test'].idempotency_keys
+
+def test_retry_replays_the_stored_response():
+    handler = Handler({'score': 80})
+
+    async def scenario():
+        collection = new_collection()
+        store = IdempotencyStore(collection)
+        first = await store.run('quiz:u1', 'k1', FP, handler)
+        again = await store.run('quiz:u1', 'k1', FP, handler)
+        # Another worker has an empty LRU and reads the stored record.
+        elsewhere = await IdempotencyStore(collection).run('quiz:u1', 'k1', FP, handler)
+        other_user = await store.run('quiz:u2', 'k1', FP, handler)
+        return first, again, elsewhere, other_user
+
+    first, again, elsewhere, other_user = asyncio.run(scenario())
+    assert first == {'score': 80}
+    for replay in (again, elsewhere):
+        assert replay.body == b'{"score":80}'
+        assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert other_user == {'score': 80}
+    assert handler.calls == 2
+
+def test_concurrent_duplicates_run_the_handler_once():
+    handler = Handler({'score': 80}, delay=0.05)
+
+    async def scenario():
+        collection = new_collection()
+        store, other_worker = IdempotencyStore(collection), IdempotencyStore(collection)
+        return await asyncio.gather(
+            store.run('quiz:u1', 'k1', FP, handler),
+            store.run('quiz:u1', 'k1', FP, handler),
+            other_worker.run('quiz:u1', 'k1', FP, handler),
+        )
+
+    first, same_worker, other_worker = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert first == {'score': 80}
+    assert same_worker.body == other_worker.body == b'{"score":80}'
+
+def test_key_reused_for_a_different_request_is_rejected():
+    handler = Handler(delay=0.05)
+
+    async def scenario():
+        collection = new_collection()
+        store = IdempotencyStore(collection)
+        await store.run('quiz:u1', 'k1', FP, handler)
+        with pytest.raises(HTTPException) as done:
+            await store.run('quiz:u1', 'k1', fingerprint({'module_id': 'm2'}), handler)
+        # Same while the original request is still pending on another worker.
+        pending = asyncio.create_task(store.run('quiz:u1', 'k2', FP, handler))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as in_flight:
+            await IdempotencyStore(collection).run('quiz:u1', 'k2', fingerprint({'module_id': 'm2'}), handler)
+        await pending
+        return done.value, in_flight.value
+
+    done, in_flight = asyncio.run(scenario())
+    assert done.status_code == in_flight.status_code == 422
+    assert handler.calls == 2
+
+@pytest.mark.parametrize('error', [RuntimeError('boom'), HTTPException(status_code=503, detail='down')])
+def test_key_is_released_when_the_handler_fails(error):
+    failing, succeeding = Handler(error=error), Handler({'score': 80})
+
+    async def scenario():
+        collection = new_collection()
+        store = IdempotencyStore(collection)
+        with pytest.raises(type(error)):
+            await store.run('quiz:u1', 'k1', FP, failing)
+        assert await collection.find_one({'_id': 'quiz:u1:k1'}) is None
+        return await store.run('quiz:u1', 'k1', FP, succeeding)
+
+    assert asyncio.run(scenario()) == {'score': 80}
+    assert succeeding.calls == 1
+
+def test_client_errors_are_stored_and_replayed():
+    handler = Handler(error=HTTPException(status_code=404, detail='Module not found'))
+
+    async def scenario():
+        store = IdempotencyStore(new_collection())
+        errors = []
+        for _ in range(2):
+            with pytest.raises(HTTPException) as e:
+                await store.run('quiz:u1', 'k1', FP, handler)
+            errors.append(e.value)
+        return errors
+
+    errors = asyncio.run(scenario())
+    assert [(e.status_code, e.detail) for e in errors] == [(404, 'Module not found')] * 2
+    assert handler.calls == 1
+
+def test_expired_lru_entries_are_ignored():
+    handler = Handler({'score': 80})
+
+    async def scenario():
+        collection = new_collection()
+        store = IdempotencyStore(collection, ttl=60)
+        await store.run('quiz:u1', 'k1', FP, handler)
+        outcome = store._lru['quiz:u1:k1']
+        assert store._lru_get('quiz:u1:k1') is outcome
+        outcome['created_at'] -= timedelta(seconds=61)
+        assert store._lru_get('quiz:u1:k1') is None
+        assert 'quiz:u1:k1' not in store._lru
+        # Once the TTL index has removed the record as well, the key is fresh again.
+        await collection.delete_many({})
+        return await store.run('quiz:u1', 'k1', FP, handler)
+
+    assert asyncio.run(scenario()) == {'score': 80}
+    assert handler.calls == 2
+
+def test_lru_is_bounded():
+    async def scenario():
+        store = IdempotencyStore(new_collection(), lru_size=2)
+        for key in ('a', 'b', 'c'):
+            await store.run('quiz:u1', key, FP, Handler())
+        return list(store._lru)
+
+    assert asyncio.run(scenario()) == ['quiz:u1:b', 'quiz:u1:c']
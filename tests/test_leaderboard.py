@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import events
+import server
+
+@pytest.fixture
+def watch(monkeypatch):
+    db = AsyncMongoMockClient()['test']
+    monkeypatch.setattr(server, 'db', db)
+    monkeypatch.setattr(server, 'broker', events.EventBroker())
+    watch = server.LeaderboardWatch(size=2, ttl=60)
+    queries = []
+    refresh = watch._refresh
+
+    async def counted_refresh():
+        queries.append(1)
+        await refresh()
+
+    monkeypatch.setattr(watch, '_refresh', counted_refresh)
+    return db, watch, queries
+
+def test_top_query_runs_at_most_once_per_ttl(watch):
+    db, watch, queries = watch
+
+    async def scenario():
+        await db.users.insert_many([{'id': 'a', 'coins': 100}, {'id': 'b', 'coins': 50}, {'id': 'c', 'coins': 10}])
+        await watch.coins_changed('a', 120)  # nobody listening: no query at all
+        server.broker.subscribe('leaderboard')
+        for coins in (130, 140, 150):
+            await watch.coins_changed('a', coins)  # in the top
+        await watch.coins_changed('c', 60)  # climbs past the floor
+        await watch.coins_changed('c', 20)  # still below it
+        await asyncio.sleep(0)
+        return server.broker._coalesced
+
+    coalesced = asyncio.run(scenario())
+    assert len(queries) == 1
+    assert coalesced == {'leaderboard'}
+
+def test_top_is_reloaded_after_the_ttl(watch):
+    db, watch, queries = watch
+    watch.ttl = 0
+
+    async def scenario():
+        await db.users.insert_many([{'id': 'a', 'coins': 100}, {'id': 'b', 'coins': 50}])
+        server.broker.subscribe('leaderboard')
+        await watch.coins_changed('a', 120)
+        await watch.coins_changed('c', 10)
+
+    asyncio.run(scenario())
+    assert len(queries) == 2
@@ -0,0 +1,235 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+
+import ledger
+
+T0 = datetime(2026, 3, 1, 12, tzinfo=timezone.utc)
+
+def at(seconds):
+    return T0 + timedelta(seconds=seconds)
+
+def run(scenario):
+    async def with_db():
+        return await scenario(AsyncMongoMockClient(tz_aware=True)['test'])
+    return asyncio.run(with_db())
+
+def test_balance_sums_entries_without_a_snapshot():
+    async def scenario(db):
+        await ledger.append(db, 'u1', 20, 'quiz', now=at(0))
+        await ledger.append(db, 'u1', -5, 'reward_redeemed', now=at(1))
+        await ledger.append(db, 'u2', 7, 'quiz', now=at(2))
+        return await ledger.balance(db, 'u1'), await ledger.balances(db, ['u1', 'u2', 'u3'])
+
+    balance, balances = run(scenario)
+    assert balance == {'balance': 15, 'snapshot_as_of': None}
+    assert balances == {'u1': 15, 'u2': 7, 'u3': 0}
+
+def test_append_many_writes_every_change_at_once():
+    async def scenario(db):
+        written = await ledger.append_many(db, 'u1', [(40, 'quiz'), (60, 'course_completed')], now=at(0))
+        stored = await db.coin_ledger.find({}, {'_id': 0}).sort('reason', 1).to_list(None)
+        return written, stored, await ledger.balance(db, 'u1')
+
+    written, stored, balance = run(scenario)
+    assert sorted(written, key=lambda e: e['reason']) == stored
+    assert [(e['reason'], e['delta'], e['at']) for e in stored] == [('course_completed', 60, at(0)), ('quiz', 40, at(0))]
+    assert balance['balance'] == 100
+
+def test_take_snapshots_advances_to_now_minus_lag():
+    async def scenario(db):
+        await ledger.append(db, 'u1', 20, 'quiz', now=at(0))
+        await ledger.append(db, 'u2', 10, 'quiz', now=at(0))
+        await ledger.append(db, 'u1', 5, 'quiz', now=at(100))
+        written = await ledger.take_snapshots(db, lag=50, now=at(100))
+        snapshots = {s['_id']: s async for s in db.coin_snapshots.find()}
+        # Nothing new since the last cutoff: no work.
+        again = await ledger.take_snapshots(db, lag=50, now=at(100))
+        return written, snapshots, again, await ledger.balance(db, 'u1')
+
+    written, snapshots, again, balance = run(scenario)
+    assert written == 2 and again == 0
+    assert {u: (s['balance'], s['as_of']) for u, s in snapshots.items()} == {'u1': (20, at(50)), 'u2': (10, at(50))}
+    # The entry after the cutoff is added on top of the snapshot.
+    assert balance == {'balance': 25, 'snapshot_as_of': at(50)}
+
+def test_snapshots_only_touch_active_users_and_never_double_count():
+    async def scenario(db):
+        await ledger.append(db, 'u1', 20, 'quiz', now=at(0))
+        await ledger.append(db, 'u2', 10, 'quiz', now=at(0))
+        await ledger.take_snapshots(db, lag=0, now=at(10))
+        await ledger.append(db, 'u1', 5, 'quiz', now=at(20))
+        written = await ledger.take_snapshots(db, lag=0, now=at(30))
+        u2 = await db.coin_snapshots.find_one({'_id': 'u2'})
+        return written, u2, await ledger.balances(db, ['u1', 'u2'])
+
+    written, u2, balances = run(scenario)
+    assert written == 1
+    assert u2['as_of'] == at(10)
+    assert balances == {'u1': 25, 'u2': 10}
+
+def test_snapshot_cutoff_is_truncated_to_milliseconds():
+    async def scenario(db):
+        await ledger.append(db, 'u1', 20, 'quiz', now=at(0))
+        await ledger.take_snapshots(db, lag=0, now=at(1.0009))
+        return await db.coin_snapshots.find_one({'_id': 'u1'}), await db.coin_snapshot_runs.find_one({'_id': 'latest'})
+
+    # BSON dates keep milliseconds; a finer cutoff would not match what is read back.
+    snapshot, last_run = run(scenario)
+    assert snapshot['as_of'] == last_run['cutoff'] == at(1.0)
+
+def test_reconcile_reports_and_fixes_drift():
+    async def scenario(db):
+        await db.users.insert_many([{'id': 'u1', 'coins': 25}, {'id': 'u2', 'coins': 13}, {'id': 'u3', 'coins': 0}])
+        await ledger.append(db, 'u1', 25, 'quiz', now=at(0))
+        await ledger.append(db, 'u2', 10, 'quiz', now=at(0))
+        await ledger.take_snapshots(db, lag=0, now=at(1))
+        found = await ledger.reconcile(db, settle=0)
+        fixed = await ledger.reconcile(db, fix=True, settle=0, batch_size=1)
+        coins = {u['id']: u['coins'] async for u in db.users.find()}
+        return found, fixed, coins, await ledger.reconcile(db, settle=0)
+
+    found, fixed, coins, after = run(scenario)
+    assert found == fixed == [{'user_id': 'u2', 'coins': 13, 'ledger': 10}]
+    assert coins == {'u1': 25, 'u2': 10, 'u3': 0}
+    assert after == []
+
+def test_reconcile_ignores_changes_that_settle(monkeypatch):
+    async def scenario(db):
+        await db.users.insert_one({'id': 'u1', 'coins': 0})
+        # Caught between the ledger insert and the users.coins $inc.
+        await ledger.append(db, 'u1', 20, 'quiz', now=at(0))
+
+        async def inc_meanwhile(delay):
+            await db.users.update_one({'id': 'u1'}, {'$inc': {'coins': 20}})
+
+        monkeypatch.setattr(ledger.asyncio, 'sleep', inc_meanwhile)
+        return await ledger.reconcile(db, fix=True, settle=1)
+
+    assert run(scenario) == []
+
+def test_open_balances_records_pre_ledger_coins_once():
+    async def scenario(db):
+        await db.users.insert_many([{'id': 'u1', 'coins': 500}, {'id': 'u2', 'coins': 0}])
+        first = await ledger.open_balances(db, now=at(0))
+        second = await ledger.open_balances(db, now=at(1))
+        window = await ledger.window_totals(db, at(-10), at(10))
+        return first, second, await ledger.balance(db, 'u1'), window
+
+    first, second, balance, window = run(scenario)
+    assert (first, second) == (1, 0)
+    assert balance['balance'] == 500
+    assert window == []
+
+def test_entries_and_window_totals():
+    async def scenario(db):
+        await ledger.append(db, 'u1', 20, 'quiz', now=at(0))
+        await ledger.append(db, 'u1', -30, 'reward_redeemed', now=at(5))
+        await ledger.append(db, 'u2', 10, 'quiz', now=at(6))
+        await ledger.append(db, 'u1', 5, 'session_rated', now=at(20))
+        entries = await ledger.entries(db, 'u1', start=at(0), end=at(20))
+        return entries, await ledger.window_totals(db, at(0), at(10))
+
+    entries, window = run(scenario)
+    assert [(e['reason'], e['at']) for e in entries] == [('reward_redeemed', at(5)), ('quiz', at(0))]
+    assert '_id' not in entries[0]
+    assert window == [{'user_id': 'u1', 'coins_earned': 20}, {'user_id': 'u2', 'coins_earned': 10}]
+
+def test_debit_needs_the_balance_to_cover_it():
+    async def scenario(db):
+        await ledger.append(db, 'u1', 50, 'quiz', now=at(0))
+        short = await ledger.debit(db, 'u1', 80, 'reward_redeemed', now=at(1))
+        paid = await ledger.debit(db, 'u1', 30, 'reward_redeemed', now=at(2))
+        return short, paid, await ledger.balance(db, 'u1')
+
+    short, paid, balance = run(scenario)
+    assert short is None
+    assert (paid['delta'], paid['debit_seq']) == (-30, 1)
+    assert balance['balance'] == 20
+
+def test_concurrent_debits_cannot_overspend(monkeypatch):
+    balance = ledger.balance
+
+    async def slow_balance(db, user_id):
+        # Both debits read the balance before either is written.
+        read = await balance(db, user_id)
+        await asyncio.sleep(0.01)
+        return read
+
+    monkeypatch.setattr(ledger, 'balance', slow_balance)
+
+    async def scenario(db):
+        await db.coin_ledger.create_index([('user_id', 1), ('debit_seq', -1)], unique=True,
+                                          partialFilterExpression={'debit_seq': {'$exists': True}})
+        await ledger.append(db, 'u1', 100, 'quiz', now=at(0))
+        paid = await asyncio.gather(*(ledger.debit(db, 'u1', 80, 'reward_redeemed') for _ in range(2)))
+        return paid, await balance(db, 'u1')
+
+    paid, after = run(scenario)
+    assert sorted(p is None for p in paid) == [False, True]
+    assert after['balance'] == 20
+
+def test_open_once_opens_a_database_once():
+    async def scenario(db):
+        await db.users.insert_many([{'id': 'u1', 'coins': 500}, {'id': 'u2', 'coins': 0}])
+        first = await ledger.open_once(db)
+        # Opened from here on: later coins in users.coins are not pre-ledger coins.
+        await db.users.update_one({'id': 'u2'}, {'$set': {'coins': 40}})
+        second = await ledger.open_once(db)
+        return first, second, await ledger.balances(db, ['u1', 'u2'])
+
+    assert run(scenario) == (True, False, {'u1': 500, 'u2': 0})
+
+def test_open_once_waits_for_a_claim_and_takes_over_stale_ones():
+    async def scenario(db):
+        await db.users.insert_one({'id': 'u1', 'coins': 500})
+        await db.coin_snapshot_runs.insert_one({'_id': ledger.OPENED, 'done': False, 'claimed_at': datetime.now(timezone.utc)})
+        waiter = asyncio.create_task(ledger.open_once(db, poll=0.01))
+        await asyncio.sleep(0.05)
+        waiting = not waiter.done()
+        await db.coin_snapshot_runs.update_one({'_id': ledger.OPENED}, {'$set': {'done': True}})
+        waited = await waiter
+
+        await db.coin_snapshot_runs.update_one({'_id': ledger.OPENED}, {'$set': {'done': False, 'claimed_at': at(0)}})
+        took_over = await ledger.open_once(db, stale=60)
+        return waiting, waited, took_over, await ledger.balance(db, 'u1')
+
+    waiting, waited, took_over, balance = run(scenario)
+    assert waiting and waited is False
+    assert took_over is True
+    assert balance['balance'] == 500
+
+def test_coins_writer_refreshes_touched_users():
+    async def scenario(db):
+        await db.users.insert_many([{'id': 'u1', 'coins': 0}, {'id': 'u2', 'coins': 0}, {'id': 'u3', 'coins': 7}])
+        writer = ledger.UserCoinsWriter(db, batch_size=1)
+        await ledger.append_many(db, 'u1', [(20, 'quiz'), (80, 'course_completed')])
+        await ledger.append(db, 'u2', 10, 'quiz')
+        writer.touch('u1')
+        writer.touch('u2')
+        written = await writer.flush()
+        coins = {u['id']: u['coins'] async for u in db.users.find()}
+        # A balance read before the stored one is not written over it.
+        await db.users.update_one({'id': 'u1'}, {'$set': {'coins_as_of': datetime.now(timezone.utc) + timedelta(hours=1)}})
+        await ledger.append(db, 'u1', 5, 'quiz')
+        writer.touch('u1')
+        await writer.flush()
+        return written, coins, (await db.users.find_one({'id': 'u1'}))['coins']
+
+    written, coins, stale = run(scenario)
+    assert written == 2
+    assert coins == {'u1': 100, 'u2': 10, 'u3': 7}
+    assert stale == 100
+
+def test_coins_writer_flushes_on_close():
+    async def scenario(db):
+        await db.users.insert_one({'id': 'u1', 'coins': 0})
+        writer = ledger.UserCoinsWriter(db, interval=3600)
+        await writer.start()
+        await ledger.append(db, 'u1', 20, 'quiz')
+        writer.touch('u1')
+        await writer.close()
+        return (await db.users.find_one({'id': 'u1'}))['coins']
+
+    assert run(scenario) == 20
@@ -0,0 +1,124 @@
+import pytest
+
+import server
+from .conftest import signup
+
+def item(course_id, module_id, *answers):
+    return {'course_id': course_id, 'module_id': module_id, 'answers': [{'answer': a} for a in answers]}
+
+@pytest.fixture
+def learner(api):
+    headers = signup(api)
+    for course_id in ('c1', 'c2'):
+        assert api.post(f'/api/courses/{course_id}/enroll', headers=headers).status_code == 200
+    return headers
+
+def submit(api, headers, *items, key=None):
+    if key:
+        headers = {**headers, 'Idempotency-Key': key}
+    response = api.post('/api/quizzes/submit/batch', headers=headers, json={'submissions': list(items)})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def coins(api, headers):
+    return api.get('/api/users/me', headers=headers).json()['coins']
+
+def ledger_reasons(api, headers):
+    entries = api.get('/api/coins/ledger', headers=headers).json()
+    return sorted((e['reason'], e['delta']) for e in entries)
+
+def attempts(api):
+    api.portal.call(server.quiz_attempt_writer.close)
+    api.portal.call(server.quiz_attempt_writer.start)
+    return api.portal.call(server.db.quiz_attempts.count_documents, {})
+
+def test_later_items_see_earlier_completions(api, learner):
+    body = submit(api, learner, item('c1', 'm1', 'a', 'b'), item('c1', 'm2', 'a'))
+
+    # m2 finishes the course only because m1 was completed earlier in the same batch.
+    assert [r['coins_earned'] for r in body['results']] == [20, 80]
+    assert body['coins_earned'] == 100
+    assert coins(api, learner) == 100
+    assert ledger_reasons(api, learner) == [('course_completed', 60), ('quiz', 40)]
+    me = api.get('/api/users/me', headers=learner).json()
+    assert me['total_courses_completed'] == 1
+    enrollment = next(e for e in api.get('/api/enrollments', headers=learner).json() if e['course_id'] == 'c1')
+    assert enrollment['progress'] == 100
+    assert enrollment['completed_modules'] == ['m1', 'm2']
+
+def test_a_module_passed_twice_in_one_batch_pays_once(api, learner):
+    body = submit(api, learner, item('c1', 'm1', 'a', 'b'), item('c1', 'm1', 'a', 'b'))
+
+    assert [(r['status'], r['passed'], r['coins_earned']) for r in body['results']] == [('ok', True, 20), ('ok', True, 0)]
+    assert coins(api, learner) == 20
+    assert attempts(api) == 2
+
+def test_unknown_course_or_module_is_reported_per_item(api, learner):
+    body = submit(api, learner, item('nope', 'm1', 'a'), item('c1', 'nope', 'a'), item('c1', 'm2', 'b'))
+
+    assert body['results'][0] == {'index': 0, 'status': 'error', 'detail': 'Course not found'}
+    assert body['results'][1] == {'index': 1, 'status': 'error', 'detail': 'Module not found'}
+    assert body['results'][2] == {'index': 2, 'status': 'ok', 'score': 0, 'passed': False, 'coins_earned': 0}
+    assert body['coins_earned'] == 0
+    assert attempts(api) == 1
+
+def test_only_unknown_items_records_nothing(api, learner):
+    body = submit(api, learner, item('nope', 'm1', 'a'))
+
+    assert body['results'][0]['status'] == 'error'
+    assert body['coins_earned'] == 0
+    assert attempts(api) == 0
+
+def test_failed_enrollment_write_is_mapped_back_to_its_items(api, learner):
+    # Passing n1 moves the c2 enrollment to 50% progress, which this unique index rejects.
+    async def conflict():
+        await server.db.enrollments.insert_one({'id': 'other', 'user_id': 'other', 'course_id': 'c2', 'progress': 50.0})
+        await server.db.enrollments.create_index([('course_id', 1), ('progress', 1)], unique=True)
+
+    api.portal.call(conflict)
+
+    body = submit(api, learner, item('c2', 'n1', 'a'), item('c1', 'm1', 'a', 'b'), item('c1', 'm2', 'a'))
+
+    assert body['results'][0] == {'index': 0, 'status': 'error', 'score': 100, 'passed': True, 'coins_earned': 0,
+                                  'detail': 'Failed to save progress'}
+    assert [(r['status'], r['coins_earned']) for r in body['results'][1:]] == [('ok', 20), ('ok', 80)]
+    assert body['coins_earned'] == 100
+    assert coins(api, learner) == 100
+    assert ledger_reasons(api, learner) == [('course_completed', 60), ('quiz', 40)]
+    c2 = next(e for e in api.get('/api/enrollments', headers=learner).json() if e['course_id'] == 'c2')
+    assert c2['completed_modules'] == [] and c2['coins_earned'] == 0
+
+def test_replay_with_the_same_key_applies_once(api, learner):
+    batch = (item('c1', 'm1', 'a', 'b'), item('c1', 'm2', 'a'))
+    first = submit(api, learner, *batch, key='batch-1')
+    again = submit(api, learner, *batch, key='batch-1')
+
+    assert again == first
+    assert coins(api, learner) == 100
+    assert len(ledger_reasons(api, learner)) == 2
+    assert attempts(api) == 2
+
+    reused = api.post('/api/quizzes/submit/batch', headers={**learner, 'Idempotency-Key': 'batch-1'},
+                      json={'submissions': [item('c1', 'm1', 'a', 'b')]})
+    assert reused.status_code == 422
+
+def test_batch_size_is_capped(api, learner, monkeypatch):
+    monkeypatch.setattr(server, 'QUIZ_BATCH_MAX', 2)
+    response = api.post('/api/quizzes/submit/batch', headers=learner, json={'submissions': [item('c1', 'm1')] * 3})
+
+    assert response.status_code == 400
+
+def test_coins_for_a_batch_are_written_once(api, learner, monkeypatch):
+    calls = []
+    add_coin_entries = server.add_coin_entries
+
+    async def counted(user_id, changes, extra_inc=None):
+        calls.append((changes, extra_inc))
+        return await add_coin_entries(user_id, changes, extra_inc)
+
+    monkeypatch.setattr(server, 'add_coin_entries', counted)
+    submit(api, learner, item('c1', 'm1', 'a', 'b'), item('c1', 'm2', 'a'), item('c2', 'n1', 'a'))
+
+    assert calls == [([(60, 'quiz'), (60, 'course_completed')], {'total_courses_completed': 1})]
+    entries = api.get('/api/coins/ledger', headers=learner).json()
+    assert len({e['at'] for e in entries}) == 1
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from rate_limit import Limit, MemoryBucketStore, RateLimiter, parse_limits
+
+def test_parse_limits_overrides_defaults():
+    limits = parse_limits(' login = 3/30 , reports=2/10,')
+    assert limits['login'] == Limit(3, 30)
+    assert limits['reports'] == Limit(2, 10)
+    assert limits['signup'] == parse_limits(None)['signup']
+
+@pytest.mark.parametrize('spec', ['login=10', 'login', '=10/60', 'login=x/60', 'login=0/60', 'login=10/0',
+                                  'login=10/-5', 'login=10/inf'])
+def test_parse_limits_rejects_malformed_spec(spec):
+    with pytest.raises(ValueError, match='Invalid RATE_LIMITS entry'):
+        parse_limits(spec)
+
+def test_bucket_refills_over_period():
+    store = MemoryBucketStore()
+    limit = Limit(2, 10)
+    acquire = lambda now: asyncio.run(store.acquire('k', limit, now=now))
+    assert acquire(0.0) == 0
+    assert acquire(0.0) == 0
+    assert acquire(0.0) == pytest.approx(5.0)
+    # Half a period later one token has come back.
+    assert acquire(5.0) == 0
+    assert acquire(5.0) == pytest.approx(5.0)
+    # Refill is capped at capacity.
+    assert acquire(100.0) == 0
+    assert acquire(100.0) == 0
+    assert acquire(100.0) > 0
+
+def test_retry_after_is_rounded_up_seconds():
+    limiter = RateLimiter({'login': Limit(1, 3)})
+
+    async def hits():
+        return [await limiter.hit('login', 'user') for _ in range(2)]
+
+    first, second = asyncio.run(hits())
+    assert first == 0
+    assert second == 3
+    assert asyncio.run(limiter.hit('unlimited', 'user')) == 0
+
+def test_idle_keys_are_evicted():
+    store = MemoryBucketStore(idle_after=10)
+    limit = Limit(1, 10)
+    for i in range(3):
+        asyncio.run(store.acquire(f'k{i}', limit, now=0.0))
+    assert len(store) == 3
+    # Each hit drops up to two idle keys from the cold end.
+    asyncio.run(store.acquire('fresh', limit, now=20.0))
+    assert len(store) == 2
+    asyncio.run(store.acquire('fresh', limit, now=21.0))
+    assert list(store._buckets) == ['fresh']
+
+def test_key_count_is_capped():
+    store = MemoryBucketStore(idle_after=1000, max_keys=3)
+    limit = Limit(1, 10)
+    for i in range(10):
+        asyncio.run(store.acquire(f'k{i}', limit, now=float(i)))
+    assert len(store) == 3
+    assert list(store._buckets) == ['k7', 'k8', 'k9']
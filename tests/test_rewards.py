@@ -0,0 +1,43 @@
+import pytest
+
+import server
+from .conftest import signup
+
+@pytest.fixture
+def learner(api):
+    api.portal.call(server.db.rewards.insert_one, {'id': 'r1', 'name': 'Mug', 'description': 'A mug', 'coin_cost': 80,
+                                                   'image': 'i', 'stock': 10})
+    api.portal.call(server.catalog.refresh)
+    headers = signup(api)
+    api.post('/api/courses/c1/enroll', headers=headers)
+    return headers
+
+def earn_100(api, headers):
+    body = {'submissions': [{'course_id': 'c1', 'module_id': 'm1', 'answers': [{'answer': 'a'}, {'answer': 'b'}]},
+                            {'course_id': 'c1', 'module_id': 'm2', 'answers': [{'answer': 'a'}]}]}
+    assert api.post('/api/quizzes/submit/batch', headers=headers, json=body).json()['coins_earned'] == 100
+
+def redeem(api, headers):
+    return api.post('/api/rewards/redeem', headers=headers, json={'reward_id': 'r1'})
+
+def test_redemption_is_checked_against_the_ledger(api, learner):
+    assert redeem(api, learner).status_code == 400
+
+    earn_100(api, learner)
+    # Redeemed before users.coins is refreshed: the ledger balance is what counts.
+    assert redeem(api, learner).status_code == 200
+    assert redeem(api, learner).status_code == 400
+
+    assert api.get('/api/coins/balance', headers=learner).json()['balance'] == 20
+    assert api.get('/api/users/me', headers=learner).json()['coins'] == 20
+    debits = [e for e in api.get('/api/coins/ledger', headers=learner).json() if e['delta'] < 0]
+    assert [(e['reason'], e['delta']) for e in debits] == [('reward_redeemed', -80)]
+    assert api.portal.call(server.db.user_rewards.count_documents, {}) == 1
+
+def test_users_coins_follows_the_ledger_for_the_leaderboard(api, learner):
+    earn_100(api, learner)
+    redeem(api, learner)
+    api.portal.call(server.coins_writer.flush)
+
+    leaders = api.get('/api/leaderboard').json()
+    assert [(u['coins'], u['total_courses_completed']) for u in leaders] == [(20, 1)]
@@ -0,0 +1,93 @@
+import math
+import random
+import string
+
+import pytest
+
+import search
+from search import SearchIndex
+
+def random_catalog(rng, courses=1500, vocabulary=400):
+    words = sorted({''.join(rng.choice(string.ascii_lowercase[:12]) for _ in range(rng.randint(2, 7)))
+                    for _ in range(vocabulary)})
+    # A few very common words, so queries exercise long postings lists.
+    common = words[:8]
+    catalog = []
+    for i in range(courses):
+        pick = lambda n: ' '.join(rng.sample(words, n) + [w for w in common if rng.random() < 0.3])
+        catalog.append({'id': f'c{i}', 'title': pick(rng.randint(1, 4)), 'description': pick(rng.randint(0, 12)),
+                        'modules': [{'title': pick(2)} for _ in range(rng.randint(0, 3))]})
+    return catalog, words
+
+def brute_force(index: SearchIndex, query: str, limit: int):
+    """Score every course directly from the BM25 definition."""
+    terms = list(dict.fromkeys(search.tokenize(query)))
+    typing = not query[-1:].isspace()
+    n = len(index.doc_lengths)
+    expansions = []
+    for position, term in enumerate(terms):
+        matches = index.expand(term, prefix=typing and position == len(terms) - 1)
+        expansions.append({m: w * math.log(1 + (n - len(index.postings[m]) + 0.5) / (len(index.postings[m]) + 0.5))
+                           for m, w in matches.items()})
+    scores = {}
+    for course_id, length in index.doc_lengths.items():
+        norm = index.k1 * (1 - index.b + index.b * length / index._scored_average)
+        total = 0.0
+        for matches in expansions:
+            best = 0.0
+            for match, factor in matches.items():
+                tf = index.postings[match].get(course_id)
+                if tf is not None:
+                    best = max(best, factor * tf * (index.k1 + 1) / (tf + norm))
+            total += best
+        if total > 0:
+            scores[course_id] = total
+    return sorted(scores.items(), key=lambda item: -item[1])[:limit], scores
+
+def random_query(rng, words):
+    terms = rng.sample(words[:8], rng.randint(0, 2)) + rng.sample(words, rng.randint(1, 3))
+    rng.shuffle(terms)
+    kind = rng.random()
+    if kind < 0.3:
+        # Still typing the last term.
+        terms[-1] = terms[-1][:rng.randint(1, len(terms[-1]))]
+        return ' '.join(terms)
+    if kind < 0.6:
+        i = rng.randrange(len(terms))
+        if len(terms[i]) >= 4:
+            j = rng.randrange(len(terms[i]))
+            terms[i] = terms[i][:j] + rng.choice('xyz') + terms[i][j + 1:]
+    return ' '.join(terms) + ' '
+
+@pytest.mark.parametrize('seed', range(3))
+def test_threshold_algorithm_matches_brute_force(seed):
+    rng = random.Random(seed)
+    catalog, words = random_catalog(rng)
+    index = SearchIndex()
+    index.rebuild(catalog)
+    for _ in range(60):
+        query, limit = random_query(rng, words), rng.choice([1, 5, 20])
+        results = index.search(query, limit)
+        expected, all_scores = brute_force(index, query, limit)
+        assert [score for _, score in results] == pytest.approx([score for _, score in expected]), query
+        # Ties at the cut-off may be broken differently, but every result must carry its true score.
+        for course_id, score in results:
+            assert score == pytest.approx(all_scores[course_id]), (query, course_id)
+
+def test_updates_are_reflected_in_results():
+    index = SearchIndex()
+    index.rebuild([
+        {'id': 'py', 'title': 'Python basics', 'description': 'Learn python', 'modules': [{'title': 'Variables'}]},
+        {'id': 'go', 'title': 'Golang', 'description': 'Concurrency in go', 'modules': []},
+    ])
+    assert [c for c, _ in index.search('pyth')] == ['py']
+    assert [c for c, _ in index.search('pythn ')] == ['py']
+    assert [c for c, _ in index.search('variables ')] == ['py']
+    index.upsert({'id': 'go', 'title': 'Golang for python programmers', 'description': '', 'modules': []})
+    assert {c for c, _ in index.search('python ')} == {'py', 'go'}
+    index.remove('py')
+    assert [c for c, _ in index.search('python ')] == ['go']
+    assert index.search('variables ') == []
+    assert 'variables' not in index.vocabulary
+    index.sync({})
+    assert len(index) == 0 and index.vocabulary == []
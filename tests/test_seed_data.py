@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import ledger
+import seed_data
+
+class FakeCollection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.inserted = 0
+
+    async def insert_many(self, docs, ordered=True):
+        if self.fail:
+            raise RuntimeError('insert failed')
+        await asyncio.sleep(0.001)
+        self.inserted += len(docs)
+
+    async def drop(self):
+        pass
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = {name: FakeCollection() for name in seed_data.SYNTHETIC_COLLECTIONS}
+    monkeypatch.setattr(seed_data, 'db', db)
+    monkeypatch.setattr(seed_data, 'synthetic_password_hash', lambda seed: 'hash')
+
+    async def open_balances(db):
+        return 0
+
+    monkeypatch.setattr(seed_data.ledger, 'open_balances', open_balances)
+    return db
+
+def small_config():
+    return seed_data.SyntheticConfig(users=50, courses=5, enrollments=80, quiz_attempts=100, p2p_sessions=10)
+
+def test_seed_synthetic_inserts_everything(fake_db):
+    asyncio.run(seed_data.seed_synthetic(small_config(), batch_size=7, concurrency=3))
+    assert fake_db['users'].inserted == 50
+    assert all(c.inserted for c in fake_db.values())
+
+def test_seed_synthetic_raises_when_a_batch_fails(fake_db):
+    fake_db['users'].fail = True
+    with pytest.raises(RuntimeError, match='insert failed'):
+        asyncio.run(seed_data.seed_synthetic(small_config(), batch_size=7, concurrency=3))
+
+def test_seeded_coins_are_recorded_in_the_ledger(monkeypatch):
+    db = AsyncMongoMockClient(tz_aware=True)['test']
+    monkeypatch.setattr(seed_data, 'db', db)
+    monkeypatch.setattr(seed_data, 'synthetic_password_hash', lambda seed: 'hash')
+
+    async def scenario():
+        await seed_data.seed_synthetic(small_config(), batch_size=7, concurrency=3)
+        coins = {u['id']: u['coins'] async for u in db.users.find({}, {'id': 1, 'coins': 1})}
+        return coins, await ledger.balances(db, list(coins))
+
+    coins, balances = asyncio.run(scenario())
+    assert any(coins.values())
+    assert balances == coins
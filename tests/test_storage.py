@@ -0,0 +1,109 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from pymongo import InsertOne, UpdateMany, UpdateOne
+
+from storage import COMPACT, DUAL, StorageCodec, decode, encode_doc
+
+USER = '0b5a6c1e-3f0d-4a8e-9c1b-2d4e6f8a0b1c'
+COURSE = '5f1d2c3b-4a59-4e6d-8c7b-9a0b1c2d3e4f'
+WHEN = '2026-03-01T12:30:00+00:00'
+
+def test_encode_filter_compact():
+    codec = StorageCodec(COMPACT)
+    query = codec.encode_filter({
+        'user_id': USER,
+        'course_id': {'$in': [COURSE, 'not-a-uuid']},
+        'completed_at': {'$gte': WHEN},
+        'score': {'$gte': 70},
+    })
+    assert query == {
+        'user_id': uuid.UUID(USER),
+        'course_id': {'$in': [uuid.UUID(COURSE), 'not-a-uuid']},
+        'completed_at': {'$gte': datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)},
+        'score': {'$gte': 70},
+    }
+
+def test_encode_filter_dual_matches_both_forms():
+    codec = StorageCodec(DUAL)
+    query = codec.encode_filter({
+        'user_id': USER,
+        'course_id': {'$ne': COURSE},
+        'last_activity': {'$lt': WHEN},
+        'streak_count': {'$gt': 0},
+    })
+    assert query == {'$and': [
+        {
+            'user_id': {'$in': [USER, uuid.UUID(USER)]},
+            'course_id': {'$nin': [COURSE, uuid.UUID(COURSE)]},
+            'streak_count': {'$gt': 0},
+        },
+        {'$or': [
+            {'last_activity': {'$lt': WHEN}},
+            {'last_activity': {'$lt': datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)}},
+        ]},
+    ]}
+
+def test_encode_filter_recurses_into_logical_operators():
+    codec = StorageCodec(COMPACT)
+    assert codec.encode_filter({'$or': [{'mentor_id': USER}, {'learner_id': USER}]}) == {
+        '$or': [{'mentor_id': uuid.UUID(USER)}, {'learner_id': uuid.UUID(USER)}],
+    }
+    assert codec.encode_filter(None) == {}
+
+def test_encode_update():
+    codec = StorageCodec(COMPACT)
+    update = codec.encode_update({
+        '$set': {'enrolled_at': WHEN, 'progress': 50},
+        '$addToSet': {'completed_modules': COURSE},
+        '$inc': {'coins': 20},
+    })
+    assert update == {
+        '$set': {'enrolled_at': datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc), 'progress': 50},
+        '$addToSet': {'completed_modules': uuid.UUID(COURSE)},
+        '$inc': {'coins': 20},
+    }
+
+def test_encode_update_pipeline_only_encodes_literals():
+    codec = StorageCodec(COMPACT)
+    pipeline = codec.encode_update([
+        {'$set': {'last_activity': WHEN, 'streak_count': {'$add': ['$streak_count', 1]}}},
+        {'$unset': 'legacy'},
+    ])
+    assert pipeline == [
+        {'$set': {'last_activity': datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc),
+                  'streak_count': {'$add': ['$streak_count', 1]}}},
+        {'$unset': 'legacy'},
+    ]
+
+def test_encode_operation_copies_bulk_operations():
+    codec = StorageCodec(COMPACT)
+    original = UpdateOne({'id': USER}, {'$set': {'course_id': COURSE}})
+    encoded = codec.encode_operation(original)
+    assert encoded._filter == {'id': uuid.UUID(USER)}
+    assert encoded._doc == {'$set': {'course_id': uuid.UUID(COURSE)}}
+    assert original._filter == {'id': USER}
+
+    insert = codec.encode_operation(InsertOne({'id': USER, 'created_at': WHEN}))
+    assert insert._doc == {'id': uuid.UUID(USER), 'created_at': datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)}
+
+    many = codec.encode_operation(UpdateMany({'user_id': USER}, [{'$set': {'redeemed_at': WHEN}}]))
+    assert many._doc == [{'$set': {'redeemed_at': datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)}}]
+
+@pytest.mark.parametrize('doc', [
+    {'id': USER, 'course_id': COURSE, 'completed_at': WHEN, 'score': 80.0, 'answers_correct': [True, False]},
+    {'id': USER, 'completed_modules': [COURSE, USER], 'enrolled_at': WHEN, 'progress': 0},
+    {'id': 'legacy-id', 'created_at': 'not a date', 'modules': [{'id': COURSE, 'title': 'Intro'}]},
+])
+def test_decode_round_trips_encoded_documents(doc):
+    assert decode(encode_doc(doc)) == doc
+
+def test_non_canonical_values_are_left_alone():
+    upper = USER.upper()
+    assert encode_doc({'id': upper}) == {'id': upper}
+    assert decode(encode_doc({'created_at': '2026-03-01T12:30:00'})) == {'created_at': WHEN}
+
+def test_string_mode_has_no_codec():
+    with pytest.raises(ValueError):
+        StorageCodec('string')
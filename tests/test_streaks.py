@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+
+import storage
+import streaks
+
+NOW = datetime(2026, 3, 10, 12, tzinfo=timezone.utc)
+
+def utc(text):
+    return datetime.fromisoformat(text).replace(tzinfo=timezone.utc)
+
+def new_user(tz_name):
+    # As signup creates it.
+    return {'id': f'user-{tz_name}', 'streak_count': 0, 'longest_streak': 0, 'last_activity': None, 'timezone': tz_name}
+
+def walk(user, times):
+    async def scenario():
+        db = AsyncMongoMockClient(tz_aware=True)['test']
+        await db.users.insert_one(dict(user))
+        steps = []
+        for when in times:
+            streak = await streaks.record_activity(db, user, utc(when))
+            stored = await db.users.find_one({'id': user['id']})
+            steps.append((streak, stored['longest_streak']))
+        return steps, stored
+
+    return asyncio.run(scenario())
+
+def test_streak_follows_local_days_across_midnight_and_gaps():
+    steps, stored = walk(new_user('Asia/Tokyo'), [
+        '2026-03-10T14:00',  # 23:00 on the 10th in Tokyo
+        '2026-03-10T15:30',  # 00:30 on the 11th: next local day, same UTC day
+        '2026-03-10T20:00',  # later on the 11th: no change
+        '2026-03-11T16:00',  # 01:00 on the 12th
+        '2026-03-14T02:00',  # the 14th, after missing the 13th: starts over
+        '2026-03-13T02:00',  # clock went backwards: no change
+        '2026-03-14T16:00',  # the 15th
+    ])
+    assert steps == [(1, 1), (2, 2), (2, 2), (3, 3), (1, 3), (1, 3), (2, 3)]
+    assert stored['streak_day'] == streaks.local_day(utc('2026-03-14T16:00'), 'Asia/Tokyo')
+    assert stored['last_activity'] == utc('2026-03-14T16:00').isoformat()
+
+def test_utc_user_counts_the_same_instants_as_one_day():
+    steps, _ = walk(new_user('UTC'), ['2026-03-10T14:00', '2026-03-10T15:30', '2026-03-11T00:10'])
+    assert steps == [(1, 1), (1, 1), (2, 2)]
+
+def test_effective_streak_lapses_after_a_missed_local_day():
+    day = streaks.local_day(utc('2026-03-14T02:00'), 'Asia/Tokyo')
+    user = {'streak_count': 4, 'streak_day': day, 'timezone': 'Asia/Tokyo'}
+    assert streaks.effective_streak(user, utc('2026-03-15T14:59')) == 4  # 23:59 on the 15th
+    assert streaks.effective_streak(user, utc('2026-03-15T15:00')) == 0  # 00:00 on the 16th
+    assert streaks.effective_streak({'streak_count': 0, 'streak_day': day}, utc('2026-03-14T02:00')) == 0
+
+def test_expire_streaks_matches_both_encodings_in_dual_mode():
+    old = NOW - timedelta(days=3)
+
+    async def scenario():
+        raw = AsyncMongoMockClient(tz_aware=True)['test']
+        await raw.users.insert_many([
+            {'id': 'string', 'streak_count': 3, 'streak_day': streaks.local_day(old, None), 'last_activity': old.isoformat()},
+            {'id': 'date', 'streak_count': 3, 'streak_day': streaks.local_day(old, None), 'last_activity': old},
+            {'id': 'live', 'streak_count': 3, 'streak_day': streaks.local_day(NOW, None), 'last_activity': NOW},
+        ])
+        expired = await streaks.expire_streaks(storage.wrap_database(raw, storage.DUAL), now=NOW)
+        users = await raw.users.find({}, {'_id': 0, 'id': 1, 'streak_count': 1}).to_list(None)
+        return expired, {u['id']: u['streak_count'] for u in users}
+
+    expired, counts = asyncio.run(scenario())
+    assert expired == 2
+    assert counts == {'string': 0, 'date': 0, 'live': 3}
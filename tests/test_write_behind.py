@@ -0,0 +1,185 @@
+import asyncio
+import contextvars
+import json
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import write_behind
+from write_behind import DUPLICATE_KEY, WriteBehindBuffer, WriteBehindFull
+
+class StubCollection:
+    name = 'attempts'
+
+    def __init__(self, failures=()):
+        # Exceptions raised by successive insert_many calls before they start succeeding.
+        self.failures = list(failures)
+        self.batches = []
+        self.blocked = None
+
+    @property
+    def docs(self):
+        return [doc for batch in self.batches for doc in batch]
+
+    async def insert_many(self, docs, ordered=True):
+        if self.blocked is not None:
+            await self.blocked.wait()
+        await asyncio.sleep(0)
+        # Like pymongo, before sending: the documents are changed in place.
+        for doc in docs:
+            doc.setdefault('_id', ObjectId())
+        if self.failures:
+            raise self.failures.pop(0)
+        self.batches.append([{k: v for k, v in doc.items() if k != '_id'} for doc in docs])
+
+def bulk_error(*errors):
+    return BulkWriteError({'writeErrors': [{'index': i, 'code': code, 'errmsg': 'failed'} for i, code in errors]})
+
+def test_flushes_full_batches_and_stragglers():
+    collection = StubCollection()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=3, flush_interval=0.01)
+        await buffer.start()
+        for i in range(7):
+            await buffer.put({'id': i})
+        await buffer.close()
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert [d['id'] for d in collection.docs] == list(range(7))
+    assert max(len(b) for b in collection.batches) == 3
+    assert buffer.inserted == 7
+
+def test_put_times_out_when_full():
+    collection = StubCollection()
+
+    async def scenario():
+        collection.blocked = asyncio.Event()
+        buffer = WriteBehindBuffer(collection, max_batch=2, flush_interval=0.01, max_pending=2, put_timeout=0.05)
+        await buffer.start()
+        await buffer.put_many([{'id': 1}, {'id': 2}])
+        with pytest.raises(WriteBehindFull):
+            await buffer.put({'id': 3})
+        # A rejected put_many queues none of its documents.
+        collection.blocked.set()
+        await buffer.put_many([{'id': 4}, {'id': 5}])
+        await buffer.close()
+
+    asyncio.run(scenario())
+    assert [d['id'] for d in collection.docs] == [1, 2, 4, 5]
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(write_behind.asyncio, 'sleep', _no_sleep)
+    collection = StubCollection([AutoReconnect('down'), AutoReconnect('down')])
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=10)
+        await buffer._insert_with_retry([{'id': 1}])
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert collection.docs == [{'id': 1}]
+    assert buffer.inserted == 1
+
+def test_rejected_documents_are_dead_lettered(tmp_path):
+    docs = [{'id': 1}, {'id': 2}, {'id': 3}]
+    collection = StubCollection([bulk_error((0, DUPLICATE_KEY), (2, 121))])
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=3, flush_interval=0.01, spill_dir=tmp_path)
+        await buffer.start()
+        await buffer.put_many(docs)
+        await asyncio.wait_for(buffer._queue.join(), 1)
+        # The flusher is still alive and writes later documents.
+        await buffer.put({'id': 4})
+        await buffer.close(timeout=1)
+
+    asyncio.run(scenario())
+    assert docs == [{'id': 1}, {'id': 2}, {'id': 3}]
+    assert collection.docs == [{'id': 4}]
+    dead = (tmp_path / 'attempts.dead.ndjson').read_text().splitlines()
+    assert [json.loads(line) for line in dead] == [{'id': 3}]
+
+def test_rejected_documents_are_counted():
+    collection = StubCollection([bulk_error((0, DUPLICATE_KEY), (2, 121))])
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection)
+        await buffer._insert_with_retry([{'id': 1}, {'id': 2}, {'id': 3}])
+        return buffer
+
+    buffer = asyncio.run(scenario())
+    assert (buffer.inserted, buffer.rejected) == (2, 1)
+
+def test_flusher_survives_a_failing_batch(monkeypatch):
+    collection = StubCollection([bulk_error((0, 121))])
+
+    def full_disk(docs):
+        raise OSError('No space left on device')
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=1, flush_interval=0.01)
+        monkeypatch.setattr(buffer, '_dead_letter', full_disk)
+        await buffer.start()
+        await buffer.put({'id': 1})
+        await buffer.put({'id': 2})
+        await buffer.close()
+
+    asyncio.run(scenario())
+    assert collection.docs == [{'id': 2}]
+
+def test_other_errors_are_not_retried():
+    collection = StubCollection([ValueError('cannot encode')])
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection)
+        await buffer._insert_with_retry([{'id': 1}, {'id': 2}])
+        return buffer
+
+    assert asyncio.run(scenario()).rejected == 2
+
+def test_spilled_segments_are_removed_once_written(tmp_path):
+    collection = StubCollection()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(collection, max_batch=2, flush_interval=0.01, spill_dir=tmp_path, segment_records=2)
+        await buffer.start()
+        for i in range(5):
+            await buffer.put({'id': i})
+        segments = sorted(p.name for p in tmp_path.iterdir())
+        await buffer.close()
+        return segments
+
+    segments = asyncio.run(scenario())
+    assert len(segments) >= 3
+    assert list(tmp_path.iterdir()) == []
+    assert len(collection.docs) == 5
+
+def test_orphaned_segments_are_replayed_once(tmp_path, monkeypatch):
+    dead_pid, pids = 999_999, contextvars.ContextVar('pid')
+    # Two workers starting together, each with its own pid.
+    monkeypatch.setattr(write_behind.os, 'getpid', pids.get)
+    monkeypatch.setattr(write_behind, '_process_alive', lambda pid: pid in (1, 2))
+    (tmp_path / f'attempts.{dead_pid}.0.ndjson').write_text('{"id": 1}\n{"id": 2}\n')
+    # Claimed by a replayer that died part-way.
+    (tmp_path / f'attempts.{dead_pid}.2.ndjson.replaying.{dead_pid + 1}').write_text('{"id": 3}\n')
+    # Cut short mid-write by the crash.
+    (tmp_path / f'attempts.{dead_pid}.3.ndjson').write_text('{"id": 4}\n{"id": 5, "sc')
+    (tmp_path / 'attempts.dead.ndjson').write_text('{"id": 0}\n')
+    collection = StubCollection()
+
+    async def worker(pid):
+        pids.set(pid)
+        await WriteBehindBuffer(collection, spill_dir=tmp_path)._replay_orphans()
+
+    async def scenario():
+        await asyncio.gather(worker(1), worker(2))
+
+    asyncio.run(scenario())
+    assert sorted(d['id'] for d in collection.docs) == [1, 2, 3, 4]
+    assert [p.name for p in tmp_path.iterdir()] == ['attempts.dead.ndjson']
+
+async def _no_sleep(delay):
+    pass